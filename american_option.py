@@ -2,66 +2,160 @@
 Author: shifulin
 Email: shifulin666@qq.com
 """
-from math import sqrt, exp, inf
+from math import sqrt, exp, log, ceil, inf
+from functools import lru_cache
 import numpy as np
+from scipy.interpolate import CubicSpline
+import jit_kernel
+import european_option
 
 
-def _call_price(s, k, sigma, r, t, steps=100):
+LATTICE_WIDTH = 2.0
+LATTICE_CACHE_SIZE = 512
+
+
+def _tree_params(sigma, r, t, steps):
     r_ = exp(r * (t / steps))
-    r_reciprocal = 1.0 / r_
     u = exp(sigma * sqrt(t / steps))
     d = 1.0 / u
-    u_square = u ** 2
     p_u = (r_ - d) / (u - d)
-    p_d = 1.0 - p_u
-    prices = np.zeros(steps + 1)
-    prices[0] = s * d ** steps
-    for i in range(1, steps + 1):
-        prices[i] = prices[i - 1] * u_square
-    values = np.zeros(steps + 1)
-    for i in range(steps + 1):
-        values[i] = max(0.0, prices[i] - k)
-    for j in range(steps, 0, -1):
-        for i in range(j):
-            values[i] = (p_u * values[i + 1] + p_d * values[i]) * r_reciprocal
-            prices[i] = d * prices[i + 1]
-            values[i] = max(values[i], prices[i] - k)
-    # print(values)
+    return 1.0 / r_, u, d, p_u, 1.0 - p_u
+
+
+def _roll_back(prices, values, k, d, p_u, p_d, r_reciprocal, is_call, stop=0):
+    # 逐行整体回推，运算顺序与逐节点回推相同，结果完全一致；stop > 0时回推到还剩stop + 1个节点的那一层为止
+    for j in range(len(values) - 1, stop, -1):
+        values[:j] = (p_u * values[1:j + 1] + p_d * values[:j]) * r_reciprocal
+        prices[:j] = d * prices[1:j + 1]
+        np.maximum(values[:j], prices[:j] - k if is_call else k - prices[:j], out=values[:j])
     return values[0]
 
 
+def _tree_price(s, k, sigma, r, t, steps, is_call):
+    r_reciprocal, u, d, p_u, p_d = _tree_params(sigma, r, t, steps)
+    prices = np.full(steps + 1, u ** 2)
+    prices[0] = s * d ** steps
+    prices = np.cumprod(prices)
+    values = np.maximum(0.0, prices - k if is_call else k - prices)
+    return _roll_back(prices, values, k, d, p_u, p_d, r_reciprocal, is_call)
+
+
+def _bbs_price(s, k, sigma, r, t, steps, is_call):
+    # 二叉树Black-Scholes: 到期前最后一步用一个步长的欧式BS价格代替，消除终点收益不光滑带来的振荡
+    r_reciprocal, u, d, p_u, p_d = _tree_params(sigma, r, t, steps)
+    prices = np.full(steps, u ** 2)
+    prices[0] = s * d ** (steps - 1)
+    prices = np.cumprod(prices)
+    values = european_option.bs_price_vec(prices, k, sigma, r, t / steps, 'Call' if is_call else 'Put')
+    np.maximum(values, prices - k if is_call else k - prices, out=values)
+    return _roll_back(prices, values, k, d, p_u, p_d, r_reciprocal, is_call)
+
+
+def bbsr_price(s, k, sigma, r, t, option_type, steps=100):
+    """二叉树Black-Scholes加Richardson外推(BBSR): 2 * P(steps) - P(steps / 2)"""
+    is_call = option_type == 'Call'
+    return 2.0 * _bbs_price(s, k, sigma, r, t, steps, is_call) - _bbs_price(s, k, sigma, r, t, steps // 2, is_call)
+
+
+def _call_price(s, k, sigma, r, t, steps=100):
+    if jit_kernel.ENABLED:
+        return jit_kernel.tree_price(s, k, sigma, r, t, steps, True)
+    return _tree_price(s, k, sigma, r, t, steps, True)
+
+
 def _put_price(s, k, sigma, r, t, steps=100):
-    r_ = exp(r * (t / steps))
+    if jit_kernel.ENABLED:
+        return jit_kernel.tree_price(s, k, sigma, r, t, steps, False)
+    return _tree_price(s, k, sigma, r, t, steps, False)
+
+
+@lru_cache(maxsize=LATTICE_CACHE_SIZE)
+def _normalized_lattice(sigma, r, t, steps, is_call):
+    """
+    行权价为1的二叉树，终点节点向两侧多延伸LATTICE_WIDTH * sqrt(steps)个节点，
+    回推到根部时得到一排对数价值度x = log(s / k)上的价格，返回在这排节点上的三次样条
+    价格对(s, k)是一次齐次的，同一个(sigma, r, t)下所有行权价共用这一棵树
+    """
+    width = ceil(LATTICE_WIDTH * sqrt(steps))
+    r_reciprocal, u, d, p_u, p_d = _tree_params(sigma, r, t, steps)
+    prices = np.full(steps + 2 * width + 1, u ** 2)
+    prices[0] = d ** (steps + 2 * width)
+    prices = np.cumprod(prices)
+    values = np.maximum(0.0, prices - 1.0 if is_call else 1.0 - prices)
+    _roll_back(prices, values, 1.0, d, p_u, p_d, r_reciprocal, is_call, 2 * width)
+    x = np.arange(-width, width + 1) * (2.0 * log(u))
+    return CubicSpline(x, values[:2 * width + 1])
+
+
+def lattice_price(s, k, sigma, r, t, option_type, steps=100):
+    """
+    用缓存的标准化二叉树插值计算美式期权价格，s和k可以是数组
+    同样取steps和steps + 1两棵树的平均，超出树覆盖范围的合约退回逐个建树
+    """
+    s, k = np.broadcast_arrays(np.asarray(s, dtype=float), np.asarray(k, dtype=float))
+    is_call = option_type == 'Call'
+    x = np.log(s / k)
+    result = np.zeros(x.shape)
+    splines = [_normalized_lattice(sigma, r, t, n, is_call) for n in (steps, steps + 1)]
+    for spline in splines:
+        result += spline(x) * k / 2.0
+    # 两棵树的覆盖范围不同，取交集，避免样条外推
+    outside = (x < max(i.x[0] for i in splines)) | (x > min(i.x[-1] for i in splines))
+    if outside.any():
+        price_func = call_price if is_call else put_price
+        result[outside] = [price_func(i, j, sigma, r, t, steps) for i, j in zip(s[outside], k[outside])]
+    return result if result.ndim else float(result)
+
+
+def call_price(s, k, sigma, r, t, steps=100, method='tree'):
+    if method == 'lattice':
+        return lattice_price(s, k, sigma, r, t, 'Call', steps)
+    elif method == 'bbsr':
+        return bbsr_price(s, k, sigma, r, t, 'Call', steps)
+    return (_call_price(s, k, sigma, r, t, steps) + _call_price(s, k, sigma, r, t, steps + 1)) / 2.0
+
+
+def put_price(s, k, sigma, r, t, steps=100, method='tree'):
+    if method == 'lattice':
+        return lattice_price(s, k, sigma, r, t, 'Put', steps)
+    elif method == 'bbsr':
+        return bbsr_price(s, k, sigma, r, t, 'Put', steps)
+    return (_put_price(s, k, sigma, r, t, steps) + _put_price(s, k, sigma, r, t, steps + 1)) / 2.0
+
+
+def _tree_price_vec(s, k, sigma, r, t, steps, is_call):
+    # 二维网格(合约 x 节点)一起回推，每个合约按自己的到期时间确定步长
+    dt = t / steps
+    r_ = np.exp(r * dt)[:, None]
     r_reciprocal = 1.0 / r_
-    u = exp(sigma * sqrt(t / steps))
+    u = np.exp(sigma * np.sqrt(dt))[:, None]
     d = 1.0 / u
-    u_square = u ** 2
     p_u = (r_ - d) / (u - d)
     p_d = 1.0 - p_u
-    prices = np.zeros(steps + 1)
-    prices[0] = s * d ** steps
-    for i in range(1, steps + 1):
-        prices[i] = prices[i - 1] * u_square
-    values = np.zeros(steps + 1)
-    for i in range(steps + 1):
-        values[i] = max(0, k - prices[i])
+    k = k[:, None]
+    sign = np.where(is_call, 1.0, -1.0)[:, None]
+    prices = np.repeat(u ** 2, steps + 1, axis=1)
+    prices[:, 0] = s * d[:, 0] ** steps
+    prices = np.cumprod(prices, axis=1)
+    values = np.maximum(0.0, sign * (prices - k))
     for j in range(steps, 0, -1):
-        for i in range(0, j):
-            values[i] = (p_u * values[i + 1] + p_d * values[i]) * r_reciprocal
-            prices[i] = d * prices[i + 1]
-            values[i] = max(values[i], k - prices[i])
-    return values[0]
+        values[:, :j] = (p_u * values[:, 1:j + 1] + p_d * values[:, :j]) * r_reciprocal
+        prices[:, :j] = d * prices[:, 1:j + 1]
+        np.maximum(values[:, :j], sign * (prices[:, :j] - k), out=values[:, :j])
+    return values[:, 0]
 
 
-def call_price(s, k, sigma, r, t, steps=100):
-    return (_call_price(s, k, sigma, r, t, steps) + _call_price(s, k, sigma, r, t, steps + 1)) / 2.0
-
+def price_vec(s, k, sigma, r, t, option_type, steps=100):
+    """批量计算美式期权价格，参数为可广播的数组，option_type为'Call'/'Put'数组，与call_price/put_price结果在舍入误差内一致"""
+    *arrays, is_call = np.broadcast_arrays(*(np.asarray(i, dtype=float) for i in (s, k, sigma, r, t)),
+                                           np.asarray(option_type) == 'Call')
+    shape = is_call.shape
+    s, k, sigma, r, t, is_call = (i.ravel() for i in arrays + [is_call])
+    return ((_tree_price_vec(s, k, sigma, r, t, steps, is_call) +
+             _tree_price_vec(s, k, sigma, r, t, steps + 1, is_call)) / 2.0).reshape(shape)
 
-def put_price(s, k, sigma, r, t, steps=100):
-    return (_put_price(s, k, sigma, r, t, steps) + _put_price(s, k, sigma, r, t, steps + 1)) / 2.0
 
-
-def delta(s, k, sigma, r, t, option_type, steps=100):
+def delta(s, k, sigma, r, t, option_type, steps=100, method='tree'):
     if t == 0.0:
         if s == k:
             return {'Call': 0.5, 'Put': -0.5}[option_type]
@@ -71,50 +165,120 @@ def delta(s, k, sigma, r, t, option_type, steps=100):
             return {'Call': 0.0, 'Put': -1.0}[option_type]
     else:
         price_func = {'Call': call_price, 'Put': put_price}[option_type]
-        return (price_func(s + 0.01, k, sigma, r, t, steps=steps) -
-                price_func(s - 0.01, k, sigma, r, t, steps=steps)) * 50.0
+        return (price_func(s + 0.01, k, sigma, r, t, steps=steps, method=method) -
+                price_func(s - 0.01, k, sigma, r, t, steps=steps, method=method)) * 50.0
 
 
-def gamma(s, k, sigma, r, t, option_type, steps=100):
+def gamma(s, k, sigma, r, t, option_type, steps=100, method='tree'):
     if t == 0.0:
         return inf if s == k else 0.0
     price_func = {'Call': call_price, 'Put': put_price}[option_type]
-    return (price_func(s + 0.01, k, sigma, r, t, steps=steps) +
-            price_func(s - 0.01, k, sigma, r, t, steps=steps) -
-            price_func(s, k, sigma, r, t, steps=steps) * 2.0) * 10000.0
+    return (price_func(s + 0.01, k, sigma, r, t, steps=steps, method=method) +
+            price_func(s - 0.01, k, sigma, r, t, steps=steps, method=method) -
+            price_func(s, k, sigma, r, t, steps=steps, method=method) * 2.0) * 10000.0
 
 
-def theta(s, k, sigma, r, t, option_type, steps=100):
+def theta(s, k, sigma, r, t, option_type, steps=100, method='tree'):
     price_func = {'Call': call_price, 'Put': put_price}[option_type]
     t_unit = 1.0 / 365.0
     if t <= t_unit:
-        return price_func(s, k, sigma, r, 0.0001, steps=steps) - \
-               price_func(s, k, sigma, r, t, steps=steps)
+        return price_func(s, k, sigma, r, 0.0001, steps=steps, method=method) - \
+               price_func(s, k, sigma, r, t, steps=steps, method=method)
     else:
-        return price_func(s, k, sigma, r, t - t_unit, steps=steps) - \
-               price_func(s, k, sigma, r, t, steps=steps)
+        return price_func(s, k, sigma, r, t - t_unit, steps=steps, method=method) - \
+               price_func(s, k, sigma, r, t, steps=steps, method=method)
 
 
-def vega(s, k, sigma, r, t, option_type, steps=100):
+def vega(s, k, sigma, r, t, option_type, steps=100, method='tree'):
     price_func = {'Call': call_price, 'Put': put_price}[option_type]
     if sigma < 0.02:
         return 0.0
     else:
-        return (price_func(s, k, sigma + 0.01, r, t, steps=steps) -
-                price_func(s, k, sigma - 0.01, r, t, steps=steps)) * 50.0
+        return (price_func(s, k, sigma + 0.01, r, t, steps=steps, method=method) -
+                price_func(s, k, sigma - 0.01, r, t, steps=steps, method=method)) * 50.0
 
 
-def rho(s, k, sigma, r, t, option_type, steps=100):
+def rho(s, k, sigma, r, t, option_type, steps=100, method='tree'):
     price_func = {'Call': call_price, 'Put': put_price}[option_type]
-    return (price_func(s, k, sigma, r + 0.001, t, steps=steps) -
-            price_func(s, k, sigma, r - 0.001, t, steps=steps)) * 500.0
+    return (price_func(s, k, sigma, r + 0.001, t, steps=steps, method=method) -
+            price_func(s, k, sigma, r - 0.001, t, steps=steps, method=method)) * 500.0
+
+
+def _extended_tree_greeks(s, k, sigma, r, t, steps, is_call):
+    """
+    从t = -2dt开始的扩展二叉树，第2步的三个节点正好在当前时刻，中间节点的价格与steps步的普通二叉树相同，
+    delta、gamma由这三个节点差分得到，theta由中间节点与根节点的差得到；
+    回推时同时对r求导(前向自动微分)，同一棵树得到rho
+    """
+    dt = t / steps
+    sqrt_dt = sqrt(dt)
+    r_ = exp(r * dt)
+    r_reciprocal = 1.0 / r_
+    u = exp(sigma * sqrt_dt)
+    d = 1.0 / u
+    p_u = (r_ - d) / (u - d)
+    p_d = 1.0 - p_u
+    p_u_r = r_ * dt / (u - d)
+    sign = 1.0 if is_call else -1.0
+    power = np.arange(-steps - 2, steps + 3, 2, dtype=float)
+    prices = s * u ** power
+    exercise = sign * (prices - k)
+    values = np.maximum(0.0, exercise)
+    values_r = np.zeros(len(values))
+    for j in range(steps + 2, 0, -1):
+        prices = d * prices[1:j + 1]
+        spread = values[1:j + 1] - values[:j]
+        hold = (p_u * values[1:j + 1] + p_d * values[:j]) * r_reciprocal
+        values_r = (p_u_r * spread + p_u * values_r[1:j + 1] + p_d * values_r[:j]) * r_reciprocal - dt * hold
+        exercise = sign * (prices - k)
+        early = exercise > hold
+        values = hold
+        if early.any():
+            values[early] = exercise[early]
+            values_r[early] = 0.0
+        if j == 3:
+            now_prices, now_values, rho = prices, values, values_r[1]
+    delta = (now_values[2] - now_values[0]) / (now_prices[2] - now_prices[0])
+    gamma = ((now_values[2] - now_values[1]) / (now_prices[2] - now_prices[1]) -
+             (now_values[1] - now_values[0]) / (now_prices[1] - now_prices[0])) * 2.0 / (now_prices[2] - now_prices[0])
+    theta = (now_values[1] - values[0]) / (2.0 * dt)
+    return now_values[1], delta, gamma, theta, rho
+
+
+def _bbs_vega(s, k, sigma, r, t, steps, is_call):
+    """
+    二叉树Black-Scholes价格对sigma的中心差分，同样取steps和steps + 1两棵树的平均
+    对离散的树直接求导会带上行权价穿过节点时的锯齿，BBS最后一步已经光滑，差分的误差比普通二叉树小一个量级
+    """
+    h = min(0.01, sigma / 2.0)
+    return sum(_bbs_price(s, k, sigma + h, r, t, n, is_call) - _bbs_price(s, k, sigma - h, r, t, n, is_call)
+               for n in (steps, steps + 1)) / (4.0 * h)
+
+
+def greeks(s, k, sigma, r, t, option_type, steps=100):
+    """
+    一次返回(price, delta, gamma, theta, vega, rho)，与baw.greeks的形状相同，
+    price与call_price/put_price相同，其余与delta/gamma/theta/vega/rho的含义相同，theta为一天的价格变化
+    和call_price一样取steps和steps + 1两棵扩展树的平均，vega由_bbs_vega得到，总共建六棵树
+    """
+    if t == 0.0:
+        price = max(s - k, 0.0) if option_type == 'Call' else max(k - s, 0.0)
+        return price, delta(s, k, sigma, r, t, option_type), gamma(s, k, sigma, r, t, option_type), 0.0, 0.0, 0.0
+    is_call = option_type == 'Call'
+    price, delta_, gamma_, theta_, rho_ = [(i + j) / 2.0 for i, j in zip(
+        _extended_tree_greeks(s, k, sigma, r, t, steps, is_call),
+        _extended_tree_greeks(s, k, sigma, r, t, steps + 1, is_call))]
+    return (float(price), float(delta_), float(gamma_), float(theta_) / 365.0,
+            float(_bbs_vega(s, k, sigma, r, t, steps, is_call)), float(rho_))
 
 
-def call_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=3.0, e=0.00001, steps=100):
+def call_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=3.0, e=0.00001, steps=100, method='tree'):
+    if jit_kernel.ENABLED and method == 'tree':
+        return jit_kernel.american_iv(c, s, k, t, r, sigma_min, sigma_max, e, steps, True)
     sigma_mid = (sigma_min + sigma_max) / 2.0
-    call_min = call_price(s, k, sigma_min, r, t, steps)
-    call_max = call_price(s, k, sigma_max, r, t, steps)
-    call_mid = call_price(s, k, sigma_mid, r, t, steps)
+    call_min = call_price(s, k, sigma_min, r, t, steps, method)
+    call_max = call_price(s, k, sigma_max, r, t, steps, method)
+    call_mid = call_price(s, k, sigma_mid, r, t, steps, method)
     diff = c - call_mid
     if c <= call_min:
         return sigma_min
@@ -126,17 +290,19 @@ def call_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=3.0, e=0.00001, steps=
         else:
             sigma_max = sigma_mid
         sigma_mid = (sigma_min + sigma_max) / 2.0
-        call_mid = call_price(s, k, sigma_mid, r, t, steps)
+        call_mid = call_price(s, k, sigma_mid, r, t, steps, method)
         diff = c - call_mid
     # print(sigma_mid)
     return sigma_mid
 
 
-def put_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=3.0, e=0.00001, steps=100):
+def put_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=3.0, e=0.00001, steps=100, method='tree'):
+    if jit_kernel.ENABLED and method == 'tree':
+        return jit_kernel.american_iv(c, s, k, t, r, sigma_min, sigma_max, e, steps, False)
     sigma_mid = (sigma_min + sigma_max) / 2.0
-    put_min = put_price(s, k, sigma_min, r, t, steps)
-    put_max = put_price(s, k, sigma_max, r, t, steps)
-    put_mid = put_price(s, k, sigma_mid, r, t, steps)
+    put_min = put_price(s, k, sigma_min, r, t, steps, method)
+    put_max = put_price(s, k, sigma_max, r, t, steps, method)
+    put_mid = put_price(s, k, sigma_mid, r, t, steps, method)
     diff = c - put_mid
     if c <= put_min:
         return sigma_min
@@ -148,7 +314,7 @@ def put_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=3.0, e=0.00001, steps=1
         else:
             sigma_max = sigma_mid
         sigma_mid = (sigma_min + sigma_max) / 2.0
-        put_mid = put_price(s, k, sigma_mid, r, t, steps)
+        put_mid = put_price(s, k, sigma_mid, r, t, steps, method)
         diff = c - put_mid
     return sigma_mid
 
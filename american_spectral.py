@@ -0,0 +1,141 @@
+"""
+Author: shifulin
+Email: shifulin666@qq.com
+
+美式期权的提前行权边界积分方程定价(Andersen-Lake-Offengelt)
+行权边界在sqrt(tau)的Chebyshev节点上做谱配置，用不动点迭代求解，再对边界做一次积分得到价格
+所有计算对一批合约同时进行，精度接近上千步的二叉树
+"""
+import numpy as np
+from numpy.polynomial.chebyshev import chebvander
+from numpy.polynomial.legendre import leggauss
+from norm_kernel import ndtr_vec, npdf_vec
+import european_option
+
+
+def _bsm_put(s, k, sigma, t, r, q):
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(s / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt_t)
+    d2 = d1 - sigma * sqrt_t
+    return k * np.exp(-r * t) * ndtr_vec(-d2) - s * np.exp(-q * t) * ndtr_vec(-d1)
+
+
+def _d_minus_plus(log_z, tau, sigma, r, q):
+    # d-(tau, z)和d+(tau, z)，log_z = log(z)
+    sigma_sqrt_tau = sigma * np.sqrt(tau)
+    d_minus = (log_z + (r - q) * tau) / sigma_sqrt_tau - sigma_sqrt_tau / 2.0
+    return d_minus, d_minus + sigma_sqrt_tau
+
+
+def _initial_boundary(tau, sigma, r, q, x):
+    # Barone-Adesi-Whaley的初始猜测: 永续期权边界和到期边界之间指数插值
+    n = 2.0 * (r - q) / sigma ** 2
+    q1 = (1.0 - n - np.sqrt((n - 1.0) ** 2 + 8.0 * r / sigma ** 2)) / 2.0
+    perpetual = q1 / (q1 - 1.0)
+    h = (r - q) * tau - 2.0 * sigma * np.sqrt(tau) * x / (x - perpetual)
+    return perpetual + (x - perpetual) * np.exp(h)
+
+
+def _normalized_put(s, sigma, r, q, t, nodes, quad_nodes, iterations):
+    """行权价为1的美式看跌，参数都是形状相同的一维数组且r > 0"""
+    column = (slice(None), None)
+    s, sigma, r, q, t = (i[column] for i in (s, sigma, r, q, t))
+    # 到期时的行权边界
+    x = np.where(q > r, r / np.where(q > r, q, 1.0), 1.0)
+    z = -np.cos(np.arange(nodes + 1) * np.pi / nodes)
+    sqrt_t = np.sqrt(t)
+    sqrt_tau = sqrt_t * (1.0 + z) / 2.0
+    tau = sqrt_tau ** 2
+    vander_inverse = np.linalg.inv(chebvander(z, nodes))
+    y, w = leggauss(quad_nodes)
+
+    def boundary_log(vander):
+        # Chebyshev插值H(sqrt(u)) = log(B(u) / x)^2，vander为积分点上的Chebyshev矩阵，返回log(B(u))
+        shape = vander.shape[:-1]
+        h = np.matmul(vander.reshape(len(vander), -1, nodes + 1), (h_nodes @ vander_inverse.T)[..., None])
+        return np.log(x.reshape((-1,) + (1,) * (len(shape) - 1))) - np.sqrt(np.maximum(h.reshape(shape), 0.0))
+
+    b = np.minimum(_initial_boundary(tau, sigma, r, q, x), x)
+    b[:, 0] = x[:, 0]
+    h_nodes = np.log(b / x) ** 2
+    # 每个配置节点上积分变量为sqrt(tau - u)，消去被积函数在u = tau处的奇异性，积分点固定，Chebyshev矩阵只算一次
+    tau_in, sqrt_tau_in = tau[:, 1:], sqrt_tau[:, 1:]
+    s_quad = sqrt_tau_in[..., None] * (1.0 + y) / 2.0
+    u = tau_in[..., None] - s_quad ** 2
+    vander = chebvander(2.0 * np.sqrt(u) / sqrt_t[..., None] - 1.0, nodes)
+    weight = w * sqrt_tau_in[..., None] / 2.0
+    sig, rate, div = sigma[..., None], r[..., None], q[..., None]
+    discount_r, discount_q = weight * np.exp(rate * u), weight * np.exp(div * u)
+    # r和q相近时不动点方程B不稳定，改用方程A
+    fixed_point_a = np.isclose(r, q)[:, 0]
+    for _ in range(iterations):
+        log_b = np.log(b[:, 1:])
+        d_minus, d_plus = _d_minus_plus(log_b, tau_in, sigma, r, q)
+        d_minus_u, d_plus_u = _d_minus_plus(log_b[..., None] - boundary_log(vander), s_quad ** 2, sig, rate, div)
+        cdf_plus_u = ndtr_vec(d_plus_u)
+        numerator = npdf_vec(d_minus) / (sigma * sqrt_tau_in) + \
+            r * np.sum(discount_r * 2.0 / sig * npdf_vec(d_minus_u), -1)
+        denominator = npdf_vec(d_plus) / (sigma * sqrt_tau_in) + ndtr_vec(d_plus) + \
+            q * np.sum(discount_q * (2.0 / sig * npdf_vec(d_plus_u) + 2.0 * s_quad * cdf_plus_u), -1)
+        ratio = numerator / denominator
+        if np.any(fixed_point_a):
+            numerator = ndtr_vec(d_minus) + r * np.sum(discount_r * 2.0 * s_quad * ndtr_vec(d_minus_u), -1)
+            denominator = ndtr_vec(d_plus) + q * np.sum(discount_q * 2.0 * s_quad * cdf_plus_u, -1)
+            ratio[fixed_point_a] = (numerator / denominator)[fixed_point_a]
+        b[:, 1:] = np.minimum(np.exp(-(r - q) * tau_in) * ratio, x)
+        h_nodes = np.log(b / x) ** 2
+    # 早行权溢价积分，积分变量同样取sqrt(t - u)，长期限时被积函数变化更大，积分节点加倍
+    y, w = leggauss(2 * quad_nodes)
+    s_quad = sqrt_t * (1.0 + y) / 2.0
+    u = t - s_quad ** 2
+    log_sb = np.log(s) - boundary_log(chebvander(2.0 * np.sqrt(u) / sqrt_t - 1.0, nodes))
+    d_minus_u, d_plus_u = _d_minus_plus(log_sb, s_quad ** 2, sigma, r, q)
+    premium = np.sum(w * sqrt_t / 2.0 * 2.0 * s_quad * (r * np.exp(-r * s_quad ** 2) * ndtr_vec(-d_minus_u)
+                                                        - q * s * np.exp(-q * s_quad ** 2) * ndtr_vec(-d_plus_u)), -1)
+    price = _bsm_put(s, 1.0, sigma, t, r, q)[:, 0] + premium
+    return np.where(s[:, 0] > b[:, -1], price, 1.0 - s[:, 0])
+
+
+def price_vec(s, k, sigma, r, t, option_type, q=0.0, nodes=8, quad_nodes=24, iterations=6):
+    """
+    批量计算美式期权价格，参数可以是数组，option_type为'Call'或'Put'
+    看涨期权用McDonald-Schroder对称性转成看跌期权: C(s, k, r, q) = P(k, s, q, r)
+    nodes为行权边界的配置节点数，quad_nodes为积分节点数，iterations为不动点迭代次数
+    """
+    s, k, sigma, r, t, option_type, q = np.broadcast_arrays(
+        *(np.asarray(i, dtype=float) for i in (s, k, sigma, r, t)), np.asarray(option_type), np.asarray(q, dtype=float))
+    is_call = option_type == 'Call'
+    spot, strike = np.where(is_call, k, s), np.where(is_call, s, k)
+    rate, dividend = np.where(is_call, q, r), np.where(is_call, r, q)
+    # 对称变换后的看跌期权，按行权价标准化，利率不为正时不会提前行权
+    m = spot / strike
+    result = np.array(_bsm_put(m, 1.0, sigma, t, rate, dividend))
+    early = (rate > 0.0) & (t > 0.0)
+    if np.any(early):
+        result[early] = _normalized_put(m[early], sigma[early], rate[early], dividend[early], t[early],
+                                        nodes, quad_nodes, iterations)
+    return result * strike
+
+
+def call_price(s, k, sigma, r, t, q=0.0):
+    return float(price_vec(s, k, sigma, r, t, 'Call', q))
+
+
+def put_price(s, k, sigma, r, t, q=0.0):
+    return float(price_vec(s, k, sigma, r, t, 'Put', q))
+
+
+def iv_vec(c, s, k, t, option_type, r=0.03, q=0.0, sigma_min=0.0001, sigma_max=3.0, e=1e-8, max_iter=50):
+    """
+    批量计算美式期权隐含波动率，见european_option.newton_iv_vec，vega用欧式vega
+    价格落在立即行权区域、对波动率不敏感的合约结果没有意义
+    """
+    def price_func(s, k, sigma, t, r, option_type, q):
+        return price_vec(s, k, sigma, r, t, option_type, q)
+
+    return european_option.newton_iv_vec(c, s, k, t, option_type, r, q, price_func, sigma_min=sigma_min,
+                                         sigma_max=sigma_max, e=e, max_iter=max_iter)
+
+
+call_iv = european_option.scalar_iv(iv_vec, 'Call')
+put_iv = european_option.scalar_iv(iv_vec, 'Put')
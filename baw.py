@@ -2,26 +2,38 @@
 Author: shifulin
 Email: shifulin666@qq.com
 """
-from math import log, sqrt, exp, inf
-from scipy.stats import norm
-import scipy.optimize as opt
+from math import log, sqrt, exp, inf, pi
+from collections import OrderedDict
+import numpy as np
+from norm_kernel import ndtr, ndtr_vec, npdf_vec
+import jit_kernel
+import european_option
+
+
+SX_CACHE_SIZE = 4096
+# 缓存键的量化步长: log(k), sigma, t, r, q，同一格子里的临界价格互相作为Newton初值
+SX_CACHE_STEPS = (0.001, 0.02, 7.0 / 365.0, 0.005, 0.005)
+_sx_cache = OrderedDict()
+_sx_cache_stats = {'hits': 0, 'warm_starts': 0, 'misses': 0}
 
 
 def bsm_call(s, k, sigma, t, r, q):
     sqrt_t = sqrt(t)
     d1 = (log(s / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt_t)
     d2 = d1 - sigma * sqrt_t
-    return s * exp(-q * t) * norm.cdf(d1) - k * exp(-r * t) * norm.cdf(d2)
+    return s * exp(-q * t) * ndtr(d1) - k * exp(-r * t) * ndtr(d2)
 
 
 def bsm_put(s, k, sigma, t, r, q):
     sqrt_t = sqrt(t)
     d1 = (log(s / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt_t)
     d2 = d1 - sigma * sqrt_t
-    return k * exp(-r * t) * norm.cdf(-d2) - s * exp(-q * t) * norm.cdf(-d1)
+    return k * exp(-r * t) * ndtr(-d2) - s * exp(-q * t) * ndtr(-d1)
 
 
 def find_sx(sx, k, sigma, t, r, q, option_type):
+    if jit_kernel.ENABLED:
+        return jit_kernel.baw_sx_residual(sx, k, sigma, t, r, q, option_type == 'Call')
     n = 2.0 * (r - q) / sigma ** 2
     k_ = 2.0 * r / sigma ** 2 / (1.0 - exp(-r * t))
     if sx < 0.0:
@@ -29,77 +41,329 @@ def find_sx(sx, k, sigma, t, r, q, option_type):
     if option_type == 'Call':
         q2 = (1.0 - n + sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
         return (bsm_call(sx, k, sigma, t, r, q) + (1.0 - exp(-q * t)
-                * norm.cdf((log(sx / k) + (r - q + sigma ** 2 / 2.0)) / (sigma * sqrt(t))))
+                * ndtr((log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt(t))))
                 * sx / q2 - sx + k) ** 2
     else:
         q1 = (1.0 - n - sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
         return (bsm_put(sx, k, sigma, t, r, q) - (1.0 - exp(-q * t)
-                * norm.cdf(-(log(sx / k) + (r - q + sigma ** 2 / 2.0)) / (sigma * sqrt(t))))
+                * ndtr(-(log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt(t))))
                 * sx / q1 + sx - k) ** 2
 
 
+def _sx_seed(k, sigma, t, r, q, is_call):
+    # Barone-Adesi-Whaley的初值: 永续期权临界价格和k之间按指数插值，指数为正(波动率极小)时直接用永续期权临界价格
+    n = 2.0 * (r - q) / sigma ** 2
+    m = 2.0 * r / sigma ** 2
+    sqrt_t = sqrt(t)
+    if is_call:
+        q2_inf = (1.0 - n + sqrt((n - 1.0) ** 2 + 4.0 * m)) / 2.0
+        sx_inf = k / (1.0 - 1.0 / q2_inf)
+        h2 = -((r - q) * t + 2.0 * sigma * sqrt_t) * k / (sx_inf - k)
+        return k + (sx_inf - k) * (1.0 - exp(h2)) if h2 < 0.0 else sx_inf
+    else:
+        q1_inf = (1.0 - n - sqrt((n - 1.0) ** 2 + 4.0 * m)) / 2.0
+        sx_inf = k / (1.0 - 1.0 / q1_inf)
+        h1 = ((r - q) * t - 2.0 * sigma * sqrt_t) * k / (k - sx_inf)
+        return sx_inf + (k - sx_inf) * exp(h1) if h1 < 0.0 else sx_inf
+
+
+def critical_price(k, sigma, t, r, q, option_type, e=1e-10, max_iter=100, seed=None):
+    """
+    Newton迭代求解临界价格sx，方程与find_sx相同，导数解析计算
+    seed为初值，默认用Barone-Adesi-Whaley的近似，q <= 0的看涨期权不会提前行权，返回inf
+    """
+    is_call = option_type == 'Call'
+    if is_call and q <= 0.0:
+        return inf
+    if jit_kernel.ENABLED:
+        return jit_kernel.baw_critical_price(k, sigma, t, r, q, e, max_iter, is_call, 0.0 if seed is None else seed)
+    n = 2.0 * (r - q) / sigma ** 2
+    k_ = 2.0 * r / (sigma ** 2 * (1.0 - exp(-r * t)))
+    sqrt_t = sqrt(t)
+    sigma_sqrt_t = sigma * sqrt_t
+    discount_q = exp(-q * t)
+    sx = _sx_seed(k, sigma, t, r, q, is_call) if seed is None else seed
+    if is_call:
+        q2 = (1.0 - n + sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
+        for _ in range(max_iter):
+            d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+            premium = 1.0 - discount_q * ndtr(d1)
+            f = sx - k - bsm_call(sx, k, sigma, t, r, q) - premium * sx / q2
+            f_prime = 1.0 - discount_q * ndtr(d1) - premium / q2 + \
+                discount_q * exp(-d1 ** 2 / 2.0) / sqrt(2.0 * pi) / (sigma_sqrt_t * q2)
+            step = f / f_prime
+            sx = sx - step if sx - step > k else (sx + k) / 2.0
+            if abs(step) < e * k:
+                break
+    else:
+        q1 = (1.0 - n - sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
+        for _ in range(max_iter):
+            d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+            premium = 1.0 - discount_q * ndtr(-d1)
+            f = k - sx - bsm_put(sx, k, sigma, t, r, q) + premium * sx / q1
+            f_prime = -1.0 + discount_q * ndtr(-d1) + premium / q1 + \
+                discount_q * exp(-d1 ** 2 / 2.0) / sqrt(2.0 * pi) / (sigma_sqrt_t * q1)
+            step = f / f_prime
+            if sx - step <= 0.0:
+                sx /= 2.0
+            else:
+                sx = sx - step if sx - step < k else (sx + k) / 2.0
+            if abs(step) < e * k:
+                break
+    return sx
+
+
+def cached_critical_price(k, sigma, t, r, q, option_type):
+    """
+    带LRU缓存的critical_price，参数完全相同时直接返回，落在同一量化格子里时用缓存的解做初值
+    bump希腊字母和隐含波动率迭代里的重复求解一两步Newton就能收敛
+    """
+    params = (k, sigma, t, r, q, option_type)
+    key = tuple(round(i / j) for i, j in zip((log(k), sigma, t, r, q), SX_CACHE_STEPS)) + (option_type,)
+    cached = _sx_cache.get(key)
+    if cached is not None and cached[0] == params:
+        _sx_cache_stats['hits'] += 1
+        _sx_cache.move_to_end(key)
+        return cached[1]
+    if cached is not None and cached[1] != inf:
+        _sx_cache_stats['warm_starts'] += 1
+        sx = critical_price(k, sigma, t, r, q, option_type, seed=cached[1])
+    else:
+        _sx_cache_stats['misses'] += 1
+        sx = critical_price(k, sigma, t, r, q, option_type)
+    _sx_cache[key] = (params, sx)
+    _sx_cache.move_to_end(key)
+    if len(_sx_cache) > SX_CACHE_SIZE:
+        _sx_cache.popitem(last=False)
+    return sx
+
+
+def sx_cache_info():
+    """缓存命中统计，hit_rate包括直接命中和热启动"""
+    total = sum(_sx_cache_stats.values())
+    return dict(_sx_cache_stats, size=len(_sx_cache), maxsize=SX_CACHE_SIZE,
+                hit_rate=(_sx_cache_stats['hits'] + _sx_cache_stats['warm_starts']) / total if total else 0.0)
+
+
+def sx_cache_clear():
+    _sx_cache.clear()
+    for i in _sx_cache_stats:
+        _sx_cache_stats[i] = 0
+
+
+def critical_price_vec(k, sigma, t, r, q, option_type, e=1e-10, max_iter=100):
+    """critical_price的向量化版本，参数可以是数组"""
+    k, sigma, t, r, q, option_type = np.broadcast_arrays(*(np.asarray(i, dtype=float) for i in (k, sigma, t, r, q)),
+                                                         np.asarray(option_type))
+    is_call = option_type == 'Call'
+    sign = np.where(is_call, 1.0, -1.0)
+    n = 2.0 * (r - q) / sigma ** 2
+    m = 2.0 * r / sigma ** 2
+    k_ = m / (1.0 - np.exp(-r * t))
+    sigma_sqrt_t = sigma * np.sqrt(t)
+    discount_q = np.exp(-q * t)
+    # 看涨用q2，看跌用q1
+    root = (1.0 - n + sign * np.sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
+    root_inf = (1.0 - n + sign * np.sqrt((n - 1.0) ** 2 + 4.0 * m)) / 2.0
+    never = is_call & (q <= 0.0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        sx_inf = k / (1.0 - 1.0 / root_inf)
+        h = ((r - q) * t + sign * 2.0 * sigma_sqrt_t) * k / (k - sx_inf)
+        exp_h = np.exp(np.minimum(h, 0.0)) * (h < 0.0)
+        sx = np.where(is_call, k + (sx_inf - k) * (1.0 - exp_h), sx_inf + (k - sx_inf) * exp_h)
+        sx = np.where(never, k, sx)
+        active = ~never
+        for _ in range(max_iter):
+            d1 = (np.log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+            d2 = d1 - sigma_sqrt_t
+            cdf_d1 = ndtr_vec(sign * d1)
+            european = sign * (sx * discount_q * cdf_d1 - k * np.exp(-r * t) * ndtr_vec(sign * d2))
+            premium = 1.0 - discount_q * cdf_d1
+            f = sign * (sx - k) - european - sign * premium * sx / root
+            f_prime = sign - sign * discount_q * cdf_d1 - sign * premium / root + \
+                discount_q * npdf_vec(d1) / (sigma_sqrt_t * root)
+            step = np.where(active, f / f_prime, 0.0)
+            new_sx = sx - step
+            # 迭代越过k或者0时取中点
+            inside = np.where(is_call, new_sx > k, (new_sx > 0.0) & (new_sx < k))
+            sx = np.where(inside, new_sx, np.where(new_sx <= 0.0, sx / 2.0, (sx + k) / 2.0))
+            active &= np.abs(step) >= e * k
+            if not np.any(active):
+                break
+    return np.where(never, np.inf, sx)
+
+
 def baw_call(s, k, sigma, t, r, q=0.0):
     c = bsm_call(s, k, sigma, t, r, q)
-    sx = opt.fmin(lambda i: find_sx(i, k, sigma, t, r, q, 'Call'), s)[0]
-    d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0)) / (sigma * sqrt(t))
+    sx = cached_critical_price(k, sigma, t, r, q, 'Call')
+    if sx == inf:
+        return c
+    d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt(t))
     n = 2.0 * (r - q) / sigma ** 2.0
     k_ = 2.0 * r / (sigma ** 2 * (1.0 - exp(-r * t)))
     q2 = (1.0 - n + sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
-    a2 = sx * (1.0 - exp(-q * t) * norm.cdf(d1)) / q2
+    a2 = sx * (1.0 - exp(-q * t) * ndtr(d1)) / q2
     return c + a2 * (s / sx) ** q2 if s < sx else s - k
 
 
 def baw_put(s, k, sigma, t, r, q=0.0):
     p = bsm_put(s, k, sigma, t, r, q)
-    sx = opt.fmin(lambda i: find_sx(i, k, sigma, t, r, q, 'Put'), s)[0]
-    d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0)) / (sigma * sqrt(t))
+    sx = cached_critical_price(k, sigma, t, r, q, 'Put')
+    d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt(t))
     n = 2.0 * (r - q) / sigma ** 2
     k_ = 2.0 * r / (sigma ** 2 * (1.0 - exp(-r * t)))
     q1 = (1.0 - n - sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
-    a1 = -sx * (1.0 - exp(-q * t) * norm.cdf(-d1)) / q1
+    a1 = -sx * (1.0 - exp(-q * t) * ndtr(-d1)) / q1
     return p + a1 * (s / sx) ** q1 if s > sx else k - s
 
 
-def call_iv(c, s, k, t, r=0.03, sigma_min=0.0001, sigma_max=3.0, e=0.00001):
-    sigma_mid = (sigma_min + sigma_max) / 2.0
-    call_min = bsm_call(s, k, sigma_min, t, r, 0.0)
-    call_max = bsm_call(s, k, sigma_max, t, r, 0.0)
-    call_mid = bsm_call(s, k, sigma_mid, t, r, 0.0)
-    diff = c - call_mid
-    if c <= call_min:
-        return sigma_min
-    elif c >= call_max:
-        return sigma_max
-    while abs(diff) > e:
-        if c > call_mid:
-            sigma_min = sigma_mid
-        else:
-            sigma_max = sigma_mid
-        sigma_mid = (sigma_min + sigma_max) / 2.0
-        call_mid = bsm_call(s, k, sigma_mid, t, r, 0.0)
-        diff = c - call_mid
-    return sigma_mid
-
-
-def put_iv(c, s, k, t, r=0.03, sigma_min=0.0001, sigma_max=3.0, e=0.00001):
-    sigma_mid = (sigma_min + sigma_max) / 2.0
-    put_min = bsm_put(s, k, sigma_min, t, r, 0.0)
-    put_max = bsm_put(s, k, sigma_max, t, r, 0.0)
-    put_mid = bsm_put(s, k, sigma_mid, t, r, 0.0)
-    diff = c - put_mid
-    if c <= put_min:
+def baw_price_vec(s, k, sigma, t, r, option_type, q=0.0):
+    """向量化的baw_call/baw_put，所有合约的临界价格一起做Newton迭代"""
+    s, k, sigma, t, r, q, option_type = np.broadcast_arrays(
+        *(np.asarray(i, dtype=float) for i in (s, k, sigma, t, r, q)), np.asarray(option_type))
+    is_call = option_type == 'Call'
+    sign = np.where(is_call, 1.0, -1.0)
+    sx = critical_price_vec(k, sigma, t, r, q, option_type)
+    sigma_sqrt_t = sigma * np.sqrt(t)
+    d1 = (np.log(s / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+    d2 = d1 - sigma_sqrt_t
+    european = sign * (s * np.exp(-q * t) * ndtr_vec(sign * d1) - k * np.exp(-r * t) * ndtr_vec(sign * d2))
+    n = 2.0 * (r - q) / sigma ** 2
+    k_ = 2.0 * r / (sigma ** 2 * (1.0 - np.exp(-r * t)))
+    root = (1.0 - n + sign * np.sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        d1_ = (np.log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+        a = sign * sx * (1.0 - np.exp(-q * t) * ndtr_vec(sign * d1_)) / root
+        price = np.where(np.isinf(sx), european, european + a * (s / sx) ** root)
+    return np.where(sign * (s - sx) < 0.0, price, sign * (s - k))
+
+
+def _greeks(s, k, sigma, t, r, q, sign, sx):
+    """
+    给定临界价格sx的解析希腊字母，返回(price, delta, gamma, theta, vega, rho)
+    提前行权溢价a * (s / sx) ** root对sigma、r、t求导时，sx的导数由边界方程按隐函数定理得到
+    """
+    sqrt_t = np.sqrt(t)
+    sigma_sqrt_t = sigma * sqrt_t
+    discount_q, discount_r = np.exp(-q * t), np.exp(-r * t)
+    n = 2.0 * (r - q) / sigma ** 2
+    h = 1.0 - discount_r
+    k_ = 2.0 * r / (sigma ** 2 * h)
+    root_d = np.sqrt((n - 1.0) ** 2 + 4.0 * k_)
+    root = (1.0 - n + sign * root_d) / 2.0
+    # 对(sigma, r, t)的偏导
+    n_grad = (-2.0 * n / sigma, 2.0 / sigma ** 2, 0.0)
+    k_grad = (-2.0 * k_ / sigma, k_ * (1.0 / r - t * discount_r / h), -k_ * r * discount_r / h)
+    root_grad = [(-i + sign * ((n - 1.0) * i + 2.0 * j) / root_d) / 2.0 for i, j in zip(n_grad, k_grad)]
+
+    def european(x):
+        # 欧式价格及其对(s, sigma, r, t)的偏导
+        d1 = (np.log(x / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+        d2 = d1 - sigma_sqrt_t
+        cdf_d1, cdf_d2, pdf_d1 = ndtr_vec(sign * d1), ndtr_vec(sign * d2), npdf_vec(d1)
+        price = sign * (x * discount_q * cdf_d1 - k * discount_r * cdf_d2)
+        vega = x * discount_q * pdf_d1 * sqrt_t
+        return price, sign * discount_q * cdf_d1, discount_q * pdf_d1 / (x * sigma_sqrt_t), \
+            (vega, sign * k * t * discount_r * cdf_d2,
+             vega * sigma / (2.0 * t) - sign * q * x * discount_q * cdf_d1 + sign * r * k * discount_r * cdf_d2)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        d1_ = (np.log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+        d1_grad = (sqrt_t - d1_ / sigma, sqrt_t / sigma, (r - q + sigma ** 2 / 2.0) / sigma_sqrt_t - d1_ / (2.0 * t))
+        cdf_d1_, pdf_d1_ = ndtr_vec(sign * d1_), npdf_vec(d1_)
+        a = sign * sx * (1.0 - discount_q * cdf_d1_) / root
+        a_x = sign * (1.0 - discount_q * cdf_d1_) / root - discount_q * pdf_d1_ / (sigma_sqrt_t * root)
+        discount_q_grad = (0.0, 0.0, -q * discount_q)
+        a_grad = [sign * sx / root * (-i * cdf_d1_ - discount_q * pdf_d1_ * sign * j) - a * l / root
+                  for i, j, l in zip(discount_q_grad, d1_grad, root_grad)]
+        _, sx_delta, _, sx_grad = european(sx)
+        # 边界方程F(x) = sign * (x - k) - european(x) - a(x)，dF/dx与critical_price里的导数相同
+        f_x = sign - sx_delta - a_x
+        price_e, delta_e, gamma_e, grad_e = european(s)
+        ratio = s / sx
+        power = ratio ** root
+        log_ratio = np.log(ratio)
+        grad = []
+        for i, j, l, m in zip(grad_e, sx_grad, a_grad, root_grad):
+            sx_theta = (j + l) / f_x
+            grad.append(i + power * (a_x * sx_theta + l + a * log_ratio * m - a * root / sx * sx_theta))
+        price = price_e + a * power
+        delta = delta_e + a * root * power / s
+        gamma = gamma_e + a * root * (root - 1.0) * power / s ** 2
+    vega, rho, theta = grad
+    continuation = np.isinf(sx) | (sign * (s - sx) < 0.0)
+    european_only = np.isinf(sx)
+    return tuple(np.where(continuation, np.where(european_only, i, j), l)
+                 for i, j, l in ((price_e, price, sign * (s - k)), (delta_e, delta, sign), (gamma_e, gamma, 0.0),
+                                  (-grad_e[2] / 365.0, -theta / 365.0, 0.0), (grad_e[0], vega, 0.0),
+                                  (grad_e[1], rho, 0.0)))
+
+
+def greeks(s, k, sigma, t, r, option_type, q=0.0):
+    """
+    一次临界价格求解得到(price, delta, gamma, theta, vega, rho)，含义与delta/gamma/theta/vega/rho相同，
+    theta为一天的价格变化，vega、rho为对sigma、r的导数
+    """
+    sign = 1.0 if option_type == 'Call' else -1.0
+    return tuple(float(i) for i in _greeks(s, k, sigma, t, r, q, sign,
+                                           cached_critical_price(k, sigma, t, r, q, option_type)))
+
+
+def greeks_vec(s, k, sigma, t, r, option_type, q=0.0):
+    """greeks的向量化版本，参数可以是数组"""
+    s, k, sigma, t, r, q, option_type = np.broadcast_arrays(
+        *(np.asarray(i, dtype=float) for i in (s, k, sigma, t, r, q)), np.asarray(option_type))
+    sign = np.where(option_type == 'Call', 1.0, -1.0)
+    return _greeks(s, k, sigma, t, r, q, sign, critical_price_vec(k, sigma, t, r, q, option_type))
+
+
+def _iv(c, s, k, t, r, q, option_type, sigma_min, sigma_max, e, max_iter):
+    price_func = baw_call if option_type == 'Call' else baw_put
+    if c <= price_func(s, k, sigma_min, t, r, q):
         return sigma_min
-    elif c >= put_max:
+    elif c >= price_func(s, k, sigma_max, t, r, q):
         return sigma_max
-    while abs(diff) > e:
-        if c > put_mid:
-            sigma_min = sigma_mid
+    sigma = float(european_option.iv_rational(c, s, k, t, option_type, r))
+    sigma = min(max(sigma, sigma_min), sigma_max) if sigma == sigma else (sigma_min + sigma_max) / 2.0
+    sign = 1.0 if option_type == 'Call' else -1.0
+    for _ in range(max_iter):
+        sx = cached_critical_price(k, sigma, t, r, q, option_type)
+        price, _, _, _, vega, _ = _greeks(s, k, sigma, t, r, q, sign, sx)
+        diff = price - c
+        if abs(diff) < e:
+            break
+        if diff < 0.0:
+            sigma_min = sigma
         else:
-            sigma_max = sigma_mid
-        sigma_mid = (sigma_min + sigma_max) / 2.0
-        put_mid = bsm_put(s, k, sigma_mid, t, r, 0.0)
-        diff = c - put_mid
-    return sigma_mid
+            sigma_max = sigma
+        new_sigma = sigma - diff / vega if vega > 0.0 else sigma_min
+        sigma = new_sigma if sigma_min < new_sigma < sigma_max else (sigma_min + sigma_max) / 2.0
+    return float(sigma)
+
+
+def call_iv(c, s, k, t, r=0.03, sigma_min=0.0001, sigma_max=3.0, e=0.00001, q=0.0, max_iter=50):
+    """
+    反解baw_call的美式隐含波动率，以欧式隐含波动率为初值，用解析vega做Newton迭代并保持二分区间
+    e为价格误差
+    """
+    return _iv(c, s, k, t, r, q, 'Call', sigma_min, sigma_max, e, max_iter)
+
+
+def put_iv(c, s, k, t, r=0.03, sigma_min=0.0001, sigma_max=3.0, e=0.00001, q=0.0, max_iter=50):
+    """反解baw_put的美式隐含波动率，参数含义与call_iv相同"""
+    return _iv(c, s, k, t, r, q, 'Put', sigma_min, sigma_max, e, max_iter)
+
+
+def iv_vec(c, s, k, t, option_type, r=0.03, q=0.0, sigma_min=0.0001, sigma_max=3.0, e=1e-8, max_iter=50):
+    """
+    call_iv/put_iv的批量版本，参数可以是数组，适合整段k线历史一次计算，见european_option.newton_iv_vec
+    价格超出[sigma_min, sigma_max]对应价格范围的合约返回区间端点
+    """
+    def vega_func(*args):
+        return greeks_vec(*args)[4]
+
+    return european_option.newton_iv_vec(c, s, k, t, option_type, r, q, baw_price_vec, vega_func, sigma_min,
+                                         sigma_max, e, max_iter)
 
 
 def delta(s, k, sigma, t, r, option_type):
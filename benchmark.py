@@ -0,0 +1,490 @@
+"""
+Author: shifulin
+Email: shifulin666@qq.com
+"""
+import sys
+from time import perf_counter
+import numpy as np
+import scipy.optimize as opt
+from scipy.stats import norm
+
+import american_option
+import american_pde
+import american_spectral
+import baw
+import bjerksund_stensland
+import european_option
+import historical_volatility
+import jit_kernel
+import norm_kernel
+import volatility_forecast
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    best, result = np.inf, None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, perf_counter() - start)
+    return best, result
+
+
+def random_chain(n, seed=0):
+    rng = np.random.default_rng(seed)
+    s = np.full(n, 3.0)
+    k = rng.uniform(2.0, 4.5, n)
+    t = rng.uniform(5.0, 365.0, n) / 365.0
+    sigma = rng.uniform(0.05, 0.8, n)
+    option_type = np.where(rng.random(n) < 0.5, 'Call', 'Put')
+    price = european_option.bs_price_vec(s, k, sigma, 0.03, t, option_type)
+    # 去掉vega过小、价格对波动率不敏感的合约，它们的隐含波动率本身没有意义
+    vega = european_option.greeks_vec(s, k, sigma, 0.03, t, option_type)[3]
+    mask = vega > 1e-3
+    return price[mask], s[mask], k[mask], t[mask], sigma[mask], option_type[mask]
+
+
+def bench_iv(n=2000):
+    price, s, k, t, sigma, option_type = random_chain(n)
+
+    def bisection():
+        return np.array([(european_option.call_iv if j == 'Call' else european_option.put_iv)(*i)
+                         for i, j in zip(zip(price, s, k, t), option_type)])
+
+    print(f'european iv, {len(price)} contracts')
+    print(f'{"method":<12}{"seconds":>12}{"max error":>14}')
+    for name, func in (('bisection', bisection),
+                       ('halley', lambda: european_option.iv_vec(price, s, k, t, option_type)[0]),
+                       ('rational', lambda: european_option.iv_rational(price, s, k, t, option_type)),
+                       ('grid', lambda: european_option.iv_grid(price, s, k, t, option_type))):
+        seconds, iv = timeit(func)
+        print(f'{name:<12}{seconds:>12.6f}{np.nanmax(np.abs(iv - sigma)):>14.3e}')
+
+
+def bench_norm(n=100000):
+    x = np.linspace(-37.0, 8.0, n)
+    cdf_error = max(abs(norm_kernel.ndtr(i) - j) / j for i, j in zip(x, norm.cdf(x)))
+    pdf_error = max(abs(norm_kernel.npdf(i) - j) / j for i, j in zip(x, norm.pdf(x)))
+    vec_cdf_error = np.max(np.abs(norm_kernel.ndtr_vec(x) / norm.cdf(x) - 1.0))
+    vec_pdf_error = np.max(np.abs(norm_kernel.npdf_vec(x) / norm.pdf(x) - 1.0))
+    print(f'scalar ndtr max relative error {cdf_error:.3e}, npdf {pdf_error:.3e}')
+    print(f'vector ndtr max relative error {vec_cdf_error:.3e}, npdf {vec_pdf_error:.3e}')
+    # 相对scipy的精度回归检查，当前误差都在1e-13以下
+    for name, error in (('ndtr', cdf_error), ('npdf', pdf_error), ('ndtr_vec', vec_cdf_error),
+                        ('npdf_vec', vec_pdf_error)):
+        assert error < 1e-12, f'norm_kernel.{name} relative error {error:.3e} against scipy'
+    sample = x[::100].tolist()
+    print(f'normal cdf/pdf, {len(sample)} scalar calls')
+    print(f'{"function":<24}{"seconds":>12}')
+    for name, func in (('scipy.stats.norm.cdf', norm.cdf), ('norm_kernel.ndtr', norm_kernel.ndtr),
+                       ('scipy.stats.norm.pdf', norm.pdf), ('norm_kernel.npdf', norm_kernel.npdf)):
+        seconds, _ = timeit(lambda: [func(i) for i in sample])
+        print(f'{name:<24}{seconds:>12.6f}')
+
+
+def bench_jit():
+    if not jit_kernel.AVAILABLE:
+        print('numba is not installed')
+        return
+    cases = (
+        ('american_option._call_price', american_option._call_price, (3.0, 3.1, 0.25, 0.03, 0.5, 100)),
+        ('american_option._put_price', american_option._put_price, (3.0, 3.1, 0.25, 0.03, 0.5, 100)),
+        ('american_option.call_iv', american_option.call_iv, (0.138, 3.046, 3.1, 0.5)),
+        ('european_option.call_iv', european_option.call_iv, (0.138, 3.046, 3.1, 0.5)),
+        ('baw.find_sx', baw.find_sx, (2900.0, 2750.0, 0.15, 78.0 / 365.0, 0.03, 0.0, 'Put')),
+        ('baw.critical_price', baw.critical_price, (2750.0, 0.15, 78.0 / 365.0, 0.03, 0.0, 'Put')),
+        ('bjerksund_stensland.bjs_put', bjerksund_stensland.bjs_put, (2710.0, 2750.0, 0.15, 78.0 / 365.0, 0.03)),
+    )
+    enabled = jit_kernel.ENABLED
+    print(f'{"kernel":<32}{"python":>12}{"numba":>12}{"speedup":>10}{"difference":>14}')
+    for name, func, args in cases:
+        jit_kernel.ENABLED = False
+        python_seconds, python_result = timeit(func, *args)
+        jit_kernel.ENABLED = True
+        func(*args)
+        jit_seconds, jit_result = timeit(func, *args)
+        print(f'{name:<32}{python_seconds:>12.6f}{jit_seconds:>12.6f}{python_seconds / jit_seconds:>10.1f}'
+              f'{abs(python_result - jit_result):>14.3e}')
+    jit_kernel.ENABLED = enabled
+
+
+def bench_tree(steps_list=(100, 500, 2000)):
+    # jit_kernel.tree_price的纯Python版本就是原来逐节点回推的实现
+    loop_tree_price = getattr(jit_kernel.tree_price, 'py_func', jit_kernel.tree_price)
+    enabled, jit_kernel.ENABLED = jit_kernel.ENABLED, False
+    print(f'{"steps":<8}{"node loop":>12}{"row slices":>12}{"speedup":>10}{"difference":>14}')
+    for steps in steps_list:
+        args = (3.0, 3.1, 0.25, 0.03, 0.5, steps, False)
+        loop_seconds, loop_result = timeit(loop_tree_price, *args, repeat=1)
+        row_seconds, row_result = timeit(american_option._tree_price, *args)
+        print(f'{steps:<8}{loop_seconds:>12.6f}{row_seconds:>12.6f}{loop_seconds / row_seconds:>10.1f}'
+              f'{abs(loop_result - row_result):>14.3e}')
+    jit_kernel.ENABLED = enabled
+
+
+def bench_tree_batch(n=200, steps=100):
+    rng = np.random.default_rng(0)
+    s = np.full(n, 2700.0)
+    k = rng.uniform(2300.0, 3100.0, n)
+    sigma = rng.uniform(0.1, 0.4, n)
+    t = rng.uniform(5.0, 300.0, n) / 365.0
+    option_type = np.where(rng.random(n) < 0.5, 'Call', 'Put')
+
+    def one_by_one():
+        return np.array([(american_option.call_price if j == 'Call' else american_option.put_price)(*i, steps)
+                         for i, j in zip(zip(s, k, sigma, np.full(n, 0.03), t), option_type)])
+
+    loop_seconds, loop_result = timeit(one_by_one, repeat=1)
+    batch_seconds, batch_result = timeit(american_option.price_vec, s, k, sigma, 0.03, t, option_type, steps)
+    print(f'american chain of {n} contracts, {steps} steps: one by one {loop_seconds:.6f}s, '
+          f'batch {batch_seconds:.6f}s, max difference {np.max(np.abs(loop_result - batch_result)):.3e}')
+
+
+def bench_lattice(n=50, steps=100):
+    k = np.linspace(2.5, 3.6, n)
+
+    def chain(method):
+        return np.array([[american_option.put_price(3.0, i, 0.25, 0.03, 0.5, steps, method=method),
+                          american_option.delta(3.0, i, 0.25, 0.03, 0.5, 'Put', steps, method=method)] for i in k])
+
+    tree_seconds, tree_result = timeit(chain, 'tree', repeat=1)
+    american_option._normalized_lattice.cache_clear()
+    lattice_seconds, lattice_result = timeit(chain, 'lattice', repeat=1)
+    print(f'american put price and delta for {n} strikes: tree {tree_seconds:.6f}s, '
+          f'shared lattice {lattice_seconds:.6f}s, max price difference '
+          f'{np.max(np.abs(tree_result[:, 0] - lattice_result[:, 0])):.3e}')
+    print(american_option._normalized_lattice.cache_info())
+
+
+def bench_bbsr(n=20, reference_steps=4000):
+    rng = np.random.default_rng(0)
+    contracts = list(zip(rng.uniform(80.0, 120.0, n), np.full(n, 100.0), rng.uniform(0.1, 0.6, n),
+                         rng.uniform(0.0, 0.1, n), rng.uniform(0.1, 1.5, n)))
+    reference = np.array([american_option.bbsr_price(*i, 'Put', reference_steps) for i in contracts])
+    print(f'american put, {n} contracts, errors against {reference_steps}-step BBSR')
+    print(f'{"method":<16}{"nodes":>10}{"seconds":>12}{"rms error":>14}{"max error":>14}')
+    cases = [('tree', 100, (101 * 102 + 102 * 103) // 2)] + \
+        [('bbsr', i, (i * (i + 1) + (i // 2) * (i // 2 + 1)) // 2) for i in (16, 24, 32, 50, 64, 100)]
+    for method, steps, nodes in cases:
+        seconds, result = timeit(lambda: np.array([american_option.put_price(*i, steps, method=method)
+                                                   for i in contracts]))
+        error = result - reference
+        print(f'{method + " " + str(steps):<16}{nodes:>10}{seconds:>12.6f}'
+              f'{np.sqrt(np.mean(error ** 2)):>14.3e}{np.max(np.abs(error)):>14.3e}')
+
+
+def bench_tree_greeks(steps=100):
+    args = (3.0, 3.1, 0.25, 0.03, 0.5, 'Put', steps)
+    funcs = (american_option.delta, american_option.gamma, american_option.theta, american_option.vega,
+             american_option.rho)
+    bump_seconds, bump_result = timeit(lambda: [american_option.put_price(*args[:5], steps)] +
+                                       [f(*args) for f in funcs])
+    tree_seconds, tree_result = timeit(american_option.greeks, *args)
+    print(f'american put greeks, {steps} steps: bump and reprice (24 trees) {bump_seconds:.6f}s, '
+          f'extended tree + bbs vega (6 trees) {tree_seconds:.6f}s')
+    print(f'{"greek":<8}{"bump":>14}{"tree":>14}')
+    for name, i, j in zip(('price', 'delta', 'gamma', 'theta', 'vega', 'rho'), bump_result, tree_result):
+        print(f'{name:<8}{i:>14.6f}{j:>14.6f}')
+
+
+def bench_pde(n=50, steps=500):
+    k = np.linspace(2.5, 3.6, n)
+    for option_type, func in (('Call', american_option.call_price), ('Put', american_option.put_price)):
+        tree_seconds, tree_result = timeit(lambda: np.array([func(3.0, i, 0.25, 0.03, 0.5, steps) for i in k]),
+                                           repeat=1)
+        american_pde.solve.cache_clear()
+        pde_seconds, pde_result = timeit(
+            lambda: american_pde.price_greeks(3.0, k, 0.25, 0.03, 0.5, option_type)[0], repeat=1)
+        print(f'american {option_type.lower()} chain of {n} strikes: {steps}-step tree {tree_seconds:.6f}s, '
+              f'crank-nicolson {pde_seconds:.6f}s, max difference {np.max(np.abs(tree_result - pde_result)):.3e}')
+
+
+def bench_spectral(n=200, reference_steps=2000):
+    rng = np.random.default_rng(0)
+    contracts = list(zip(rng.uniform(80.0, 120.0, n), np.full(n, 100.0), rng.uniform(0.1, 0.6, n),
+                         rng.uniform(0.01, 0.1, n), rng.uniform(0.1, 3.0, n)))
+    s, k, sigma, r, t = (np.array(i) for i in zip(*contracts))
+    reference = np.array([american_option.bbsr_price(*i, 'Put', reference_steps) for i in contracts])
+    print(f'american put, {n} contracts, errors against {reference_steps}-step BBSR')
+    print(f'{"method":<16}{"us/option":>12}{"rms error":>14}{"max error":>14}')
+    for name, func in (('tree 100', lambda: np.array([american_option.put_price(*i) for i in contracts])),
+                       ('baw', lambda: baw.baw_price_vec(s, k, sigma, t, r, 'Put')),
+                       ('spectral', lambda: american_spectral.price_vec(s, k, sigma, r, t, 'Put'))):
+        seconds, result = timeit(func, repeat=1)
+        error = result - reference
+        print(f'{name:<16}{seconds / n * 1e6:>12.1f}{np.sqrt(np.mean(error ** 2)):>14.3e}'
+              f'{np.max(np.abs(error)):>14.3e}')
+
+
+def bench_baw_sx(n=200):
+    rng = np.random.default_rng(0)
+    k, sigma, t, r, q = np.full(n, 2750.0), rng.uniform(0.1, 0.5, n), rng.uniform(5.0, 365.0, n) / 365.0, \
+        np.full(n, 0.03), rng.uniform(0.0, 0.06, n)
+    option_type = np.where(rng.random(n) < 0.5, 'Call', 'Put')
+    contracts = list(zip(k, sigma, t, r, q, option_type))
+
+    def nelder_mead():
+        # 原来的做法: 从现价附近用fmin最小化残差平方
+        return np.array([opt.fmin(lambda x: baw.find_sx(float(x[0]), *i), i[0], disp=False)[0] for i in contracts])
+
+    fmin_seconds, fmin_result = timeit(nelder_mead, repeat=1)
+    newton_seconds, newton_result = timeit(lambda: np.array([baw.critical_price(*i) for i in contracts]))
+    vec_seconds, vec_result = timeit(baw.critical_price_vec, k, sigma, t, r, q, option_type)
+    finite = np.isfinite(newton_result)
+    print(f'baw critical price, {n} contracts: fmin {fmin_seconds:.6f}s, newton {newton_seconds:.6f}s, '
+          f'vectorized newton {vec_seconds:.6f}s')
+    print(f'max relative difference: fmin {np.max(np.abs(fmin_result / newton_result - 1.0)[finite]):.3e}, '
+          f'vectorized {np.max(np.abs(vec_result / newton_result - 1.0)[finite]):.3e}')
+
+
+def bench_baw_cache(n=200):
+    rng = np.random.default_rng(0)
+    contracts = list(zip(np.full(n, 2700.0), rng.uniform(2300.0, 3100.0, n), rng.uniform(0.1, 0.4, n),
+                         rng.uniform(5.0, 300.0, n) / 365.0, np.full(n, 0.03)))
+    funcs = (baw.delta, baw.gamma, baw.theta, baw.vega, baw.rho)
+
+    def all_greeks():
+        return np.array([[f(*i, 'Put') for f in funcs] for i in contracts])
+
+    size = baw.SX_CACHE_SIZE
+    baw.SX_CACHE_SIZE = 0
+    baw.sx_cache_clear()
+    cold_seconds, cold_result = timeit(all_greeks, repeat=1)
+    baw.SX_CACHE_SIZE = size
+    baw.sx_cache_clear()
+    warm_seconds, warm_result = timeit(all_greeks, repeat=1)
+    print(f'baw put greeks for {n} contracts: no cache {cold_seconds:.6f}s, sx cache {warm_seconds:.6f}s, '
+          f'max difference {np.max(np.abs(cold_result - warm_result)):.3e}')
+    print(baw.sx_cache_info())
+
+
+def bench_baw_greeks(n=200):
+    rng = np.random.default_rng(0)
+    contracts = list(zip(np.full(n, 2700.0), rng.uniform(2300.0, 3100.0, n), rng.uniform(0.1, 0.4, n),
+                         rng.uniform(5.0, 300.0, n) / 365.0, np.full(n, 0.03),
+                         np.where(rng.random(n) < 0.5, 'Call', 'Put'), rng.uniform(0.0, 0.03, n)))
+    funcs = (baw.delta, baw.gamma, baw.theta, baw.vega, baw.rho)
+    # 原来的差分希腊字母只支持q = 0
+    fd_contracts = [i[:6] for i in contracts]
+    fd_seconds, fd_result = timeit(lambda: np.array([[f(*i) for f in funcs] for i in fd_contracts]), repeat=1)
+    analytic_seconds, analytic_result = timeit(lambda: np.array([baw.greeks(*i[:6])[1:] for i in contracts]))
+    vec_seconds, vec_result = timeit(baw.greeks_vec, *(np.array(i) for i in zip(*fd_contracts)))
+    print(f'baw greeks for {n} contracts: finite differences {fd_seconds:.6f}s, analytic {analytic_seconds:.6f}s, '
+          f'vectorized {vec_seconds:.6f}s')
+
+    def fine_differences(s, k, sigma, t, r, option_type):
+        # 步长很小的中心差分，不会越过提前行权边界
+        f = baw.baw_call if option_type == 'Call' else baw.baw_put
+        ds, dv = s * 1e-3, 1e-5
+        return ((f(s + ds, k, sigma, t, r) - f(s - ds, k, sigma, t, r)) / (2.0 * ds),
+                (f(s + ds, k, sigma, t, r) + f(s - ds, k, sigma, t, r) - 2.0 * f(s, k, sigma, t, r)) / ds ** 2,
+                (f(s, k, sigma, t - dv, r) - f(s, k, sigma, t + dv, r)) / (2.0 * dv * 365.0),
+                (f(s, k, sigma + dv, t, r) - f(s, k, sigma - dv, t, r)) / (2.0 * dv),
+                (f(s, k, sigma, t, r + dv) - f(s, k, sigma, t, r - dv)) / (2.0 * dv))
+
+    fine_result = np.array([fine_differences(*i) for i in fd_contracts])
+    # 原来的差分步长固定(现价0.01、波动率0.01、theta为一天)，靠近临界价格时会越过边界，差异主要来自这里
+    print(f'{"greek":<8}{"median |analytic - fd|":>24}{"max |analytic - fine fd|":>26}{"max |vec - analytic|":>22}')
+    # 与小步长差分比较的容差，约为当前误差的10倍，差分本身的截断误差在这个量级以下
+    tolerances = (1e-3, 1e-5, 1e-6, 1e-3, 1e-4)
+    for i, (name, tolerance) in enumerate(zip(('delta', 'gamma', 'theta', 'vega', 'rho'), tolerances)):
+        fine_error = np.max(np.abs(analytic_result[:, i] - fine_result[:, i]))
+        vec_error = np.max(np.abs(vec_result[i + 1] - analytic_result[:, i]))
+        print(f'{name:<8}{np.median(np.abs(analytic_result[:, i] - fd_result[:, i])):>24.3e}'
+              f'{fine_error:>26.3e}{vec_error:>22.3e}')
+        assert fine_error < tolerance, f'baw {name} differs from fine differences by {fine_error:.3e}'
+        assert vec_error < 1e-9, f'baw greeks_vec {name} differs from greeks by {vec_error:.3e}'
+    q_result = np.array([baw.greeks(*i) for i in contracts])
+    q_vec_result = baw.greeks_vec(*(np.array(i) for i in zip(*contracts)))
+    q_error = max(np.max(np.abs(i - j)) for i, j in zip(q_vec_result, q_result.T))
+    print(f'with dividend yield, max |vec - scalar| {q_error:.3e}')
+    assert q_error < 1e-9, f'baw greeks_vec with dividend yield differs from greeks by {q_error:.3e}'
+
+
+def bench_bjs(n=200, reference_steps=2000):
+    rng = np.random.default_rng(0)
+    contracts = list(zip(np.full(n, 2700.0), rng.uniform(2300.0, 3100.0, n), rng.uniform(0.1, 0.4, n),
+                         rng.uniform(5.0, 300.0, n) / 365.0, np.full(n, 0.03)))
+    s, k, sigma, t, r = (np.array(i) for i in zip(*contracts))
+    reference = np.array([american_option.bbsr_price(i, j, l, o, m, 'Put', reference_steps)
+                          for i, j, l, m, o in contracts])
+    print(f'american put, {n} contracts, errors against {reference_steps}-step BBSR')
+    print(f'{"method":<24}{"us/option":>12}{"rms error":>14}{"max error":>14}')
+    for name, func in (
+            ('american_option tree', lambda: np.array([american_option.put_price(i, j, l, o, m)
+                                                       for i, j, l, m, o in contracts])),
+            ('baw.baw_put', lambda: np.array([baw.baw_put(*i) for i in contracts])),
+            ('baw.baw_price_vec', lambda: baw.baw_price_vec(s, k, sigma, t, r, 'Put')),
+            ('bjs_put', lambda: np.array([bjerksund_stensland.bjs_put(*i) for i in contracts])),
+            ('bjs_price_vec', lambda: bjerksund_stensland.bjs_price_vec(s, k, sigma, t, r, 'Put'))):
+        baw.sx_cache_clear()
+        seconds, result = timeit(func, repeat=1)
+        error = result - reference
+        print(f'{name:<24}{seconds / n * 1e6:>12.1f}{np.sqrt(np.mean(error ** 2)):>14.3e}'
+              f'{np.max(np.abs(error)):>14.3e}')
+    price = bjerksund_stensland.bjs_price_vec(s, k, sigma, t, r, 'Put')
+    seconds, iv = timeit(bjerksund_stensland.iv_vec, price, s, k, t, 'Put', r)
+    exercised = price <= k - s + 1e-12
+    print(f'bjs iv for {n} puts: {seconds:.6f}s, max error {np.max(np.abs(iv - sigma)[~exercised]):.3e} '
+          f'({np.sum(exercised)} contracts in the exercise region skipped)')
+
+
+def bench_baw_iv(n=250):
+    # 一段k线历史: 同一个合约，现价随机游走，到期时间逐日减少
+    rng = np.random.default_rng(0)
+    s = 2700.0 * np.exp(np.cumsum(rng.normal(0.0, 0.015, n)))
+    t = np.arange(n + 20, 20, -1) / 365.0
+    sigma = 0.2 + 0.05 * np.sin(np.arange(n) / 20.0)
+    price = baw.baw_price_vec(s, 2750.0, sigma, t, 0.03, 'Put')
+    # 价格不高于内在价值时波动率无法确定(包括BAW近似低于内在价值的深度实值合约)
+    valid = price > 2750.0 - s + 1e-6
+    european_seconds, european_iv = timeit(lambda: np.array([european_option.put_iv(*i, r=0.03, sigma_max=3.0)
+                                                             for i in zip(price, s, np.full(n, 2750.0), t)]))
+    baw.sx_cache_clear()
+    scalar_seconds, scalar_iv = timeit(lambda: np.array([baw.put_iv(*i) for i in zip(price, s, np.full(n, 2750.0), t)]))
+    batch_seconds, batch_iv = timeit(baw.iv_vec, price, s, 2750.0, t, 'Put')
+    print(f'baw put iv over {n} days ({np.sum(~valid)} at or below intrinsic value skipped)')
+    print(f'{"method":<24}{"seconds":>12}{"max error":>14}')
+    for name, seconds, iv in (('european bisection', european_seconds, european_iv),
+                              ('baw newton', scalar_seconds, scalar_iv), ('baw newton batch', batch_seconds, batch_iv)):
+        print(f'{name:<24}{seconds:>12.6f}{np.max(np.abs(iv - sigma)[valid]):>14.3e}')
+
+
+def bench_hv(n=2500, codes=200, window_size=(5, 15, 30, 50, 70, 90, 120, 150)):
+    # 十年日线收益率，逐个窗口用np.std和滑动累计和对比
+    rng = np.random.default_rng(0)
+    y = rng.normal(0.0003, 0.015, n).tolist()
+    factor = np.sqrt(252) * 100.0
+
+    def naive():
+        y2 = y[::-1]
+        return [np.array([np.std(y2[i: i + w]) * factor for i in range(len(y2) - w + 1)]) for w in window_size]
+
+    naive_seconds, expected = timeit(naive, repeat=1)
+    seconds, (hv_lines, _) = timeit(historical_volatility.cal_historical_volatility, y, window_size)
+    error = max(np.max(np.abs(i - j)) for i, j in zip(hv_lines, expected))
+    print(f'historical volatility, {n} days, {len(window_size)} windows: np.std loop {naive_seconds:.4f}s, '
+          f'rolling sums {seconds:.6f}s, max diff {error:.3e}')
+    batch = rng.normal(0.0003, 0.015, (codes, n))
+    seconds, _ = timeit(historical_volatility.rolling_std_windows, batch, window_size)
+    print(f'{codes} underlyings at once: {seconds:.6f}s')
+
+
+def bench_range_hv(n=2500, window=20, steps=390, sigma=0.25, overnight=0.2):
+    # 日内几何布朗运动模拟开高低收，overnight为隔夜方差占比，比较各估计量在同一窗口长度下的偏差和离散度
+    rng = np.random.default_rng(0)
+    daily = sigma / np.sqrt(252.0)
+    gap = rng.normal(0.0, daily * np.sqrt(overnight), n)
+    path = np.cumsum(rng.normal(0.0, daily * np.sqrt((1.0 - overnight) / steps), (n, steps)), axis=1)
+    close = np.cumsum(gap + path[:, -1])
+    o = close - path[:, -1]
+    h, l = np.maximum(o + path.max(axis=1), o), np.minimum(o + path.min(axis=1), o)
+    y = np.diff(close)
+    ohlc = tuple(np.exp(i[1:]) for i in (o, h, l, close))
+    print(f'hv estimators, {n} days, window {window}, true volatility {sigma * 100:.1f}% '
+          f'({overnight * 100:.0f}% overnight variance)')
+    print(f'{"method":<20}{"seconds":>12}{"mean":>10}{"std":>10}')
+    for method in ('close', 'parkinson', 'garman_klass', 'rogers_satchell', 'yang_zhang'):
+        seconds, (hv_lines, _) = timeit(historical_volatility.cal_historical_volatility, y, (window,), ohlc, method)
+        print(f'{method:<20}{seconds:>12.6f}{np.mean(hv_lines[0]):>10.2f}{np.std(hv_lines[0]):>10.2f}')
+
+
+def bench_vol_cone(n=2500, bars=250, window_size=(5, 15, 30, 50, 70, 90, 120, 150)):
+    # 已有n天历史，之后每天新增一根k线: 全量重算hv_cone和增量更新VolCone对比
+    rng = np.random.default_rng(0)
+    y = rng.normal(0.0, 1.0, n + bars) * 0.015 * np.exp(np.cumsum(rng.normal(0.0, 0.03, n + bars)))
+    cone = historical_volatility.VolCone(window_size)
+    init_seconds, _ = timeit(cone.extend, y[:n], repeat=1)
+    start = perf_counter()
+    for i in range(n, n + bars):
+        _, expected = historical_volatility.cal_historical_volatility(y[:i + 1], window_size)
+    full_seconds = (perf_counter() - start) / bars
+    start = perf_counter()
+    for i in range(n, n + bars):
+        cone.update(y[i])
+        result = cone.cone()
+    update_seconds = (perf_counter() - start) / bars
+    error = np.max(np.abs(result / np.array(expected) - 1.0))
+    print(f'vol cone, {n} days of history, {len(window_size)} windows: initial {init_seconds:.4f}s, '
+          f'full recompute {full_seconds * 1e3:.3f}ms/bar, incremental {update_seconds * 1e3:.3f}ms/bar, '
+          f'max relative error {error:.2e}')
+
+
+def bench_universe(codes=200, window_size=(5, 15, 30, 50, 70, 90, 120, 150)):
+    # 长度不同的收益率序列，逐个标的计算和右对齐后二维一次计算对比
+    rng = np.random.default_rng(0)
+    y_list = [rng.normal(0.0, 0.015, i) for i in rng.integers(250, 4000, codes)]
+    loop_seconds, expected = timeit(lambda: [historical_volatility.cal_historical_volatility(i, window_size)[1]
+                                             for i in y_list], repeat=1)
+    seconds, (_, hv_cone) = timeit(historical_volatility.cal_universe_volatility, y_list, window_size)
+    error = np.max(np.abs(hv_cone - np.array(expected)))
+    print(f'universe hv, {codes} codes, {len(window_size)} windows: per code {loop_seconds:.4f}s, '
+          f'2-D {seconds:.4f}s, max cone diff {error:.3e}')
+
+
+def bench_stock_fluctuation(years=30, dividends=30):
+    # 合成的ETF和指数日线，与逐行解析日期、逐根k线查找除权日的写法对比
+    rng = np.random.default_rng(0)
+    dates = np.arange(np.datetime64('1990-01-01'), np.datetime64('1990-01-01') + 365 * years)
+    dates = dates[np.is_busday(dates)]
+    kline = {code: [{'date': f'{d}T00:00:00.000Z', 'close': float(c)}
+                    for d, c in zip(dates[start:], np.exp(np.cumsum(rng.normal(0.0, 0.01, len(dates) - start))))]
+             for code, start in (('sh510050', 20), ('sh000016', 0))}
+    ex_date = np.sort(rng.choice(dates[30:], dividends, replace=False))[::-1]
+    ex = {'sh510050': [{'djr': f'{d} 00:00:00'} for d in ex_date]}
+
+    def loop():
+        x, y = [], []
+        kline_data = kline['sh510050']
+        for index, i in enumerate(kline_data[1:], 1):
+            y.append(np.log(i['close'] / kline_data[index - 1]['close']))
+            x.append(int(''.join(i['date'][:10].split('-'))))
+        listed_date = int(''.join(kline_data[0]['date'][:10].split('-')))
+        ex_list = [j for j in (int(''.join(i['djr'][:10].split('-'))) for i in ex['sh510050']) if j > listed_date][::-1]
+        ex_result, last_date, last_close = {}, 0, 0.0
+        for index, i in enumerate(kline['sh000016']):
+            this_date = int(''.join(i['date'][:10].split('-')))
+            if index > 0 and ex_list and last_date <= ex_list[0] < this_date:
+                ex_result[this_date] = np.log(i['close'] / last_close)
+                ex_list = ex_list[1:]
+            last_date, last_close = this_date, i['close']
+        for index, i in enumerate(x):
+            if i in ex_result:
+                y[index] = ex_result[i]
+        return x, y
+
+    loop_seconds, (x, y) = timeit(loop, repeat=1)
+    seconds, (x2, y2) = timeit(historical_volatility.cal_stock_fluctuation, 'sh510050', kline, ex)
+    print(f'stock fluctuation, {len(dates)} days, {dividends} dividends: loop {loop_seconds:.4f}s, '
+          f'arrays {seconds:.4f}s, dates equal {np.array_equal(x, x2)}, '
+          f'max diff {np.max(np.abs(np.array(y) - y2)):.3e}')
+
+
+def bench_garch(n=2500, codes=200, params=(2e-6, 0.08, 0.9)):
+    # 模拟GARCH(1,1)收益率，解析梯度和数值梯度的拟合对比，冷启动和用前一天参数热启动对比
+    rng = np.random.default_rng(0)
+    omega, alpha, beta = params
+    y = np.empty((codes, n + 1))
+    h = np.full(codes, omega / (1.0 - alpha - beta))
+    for t in range(n + 1):
+        y[:, t] = np.sqrt(h) * rng.normal(0.0, 1.0, codes)
+        h = omega + alpha * y[:, t] ** 2 + beta * h
+    e2 = ((y[0, :n] - np.mean(y[0, :n])) * volatility_forecast.SCALE) ** 2
+    numeric_seconds, numeric = timeit(opt.minimize, lambda x: volatility_forecast._garch_nll(x, e2, np.mean(e2))[0],
+                                      [np.mean(e2) * 0.05, 0.05, 0.9], method='SLSQP',
+                                      bounds=((1e-8, None), (0.0, 1.0), (0.0, 1.0)), options={'ftol': 1e-10})
+    cold_seconds, cold = timeit(volatility_forecast.garch_fit, y[0, :n])
+    warm_seconds, _ = timeit(volatility_forecast.garch_fit, y[0], cold)
+    print(f'garch(1,1) fit, {n} days, true {params}: numeric gradient {numeric_seconds * 1e3:.2f}ms, '
+          f'analytic gradient {cold_seconds * 1e3:.2f}ms, warm start {warm_seconds * 1e3:.2f}ms')
+    print(f'analytic {cold}, numeric {numeric.x / np.array([volatility_forecast.SCALE ** 2, 1.0, 1.0])}')
+    y_list = list(y[:, :n])
+    cold_seconds, (_, _, fitted) = timeit(volatility_forecast.cal_universe_forecast, y_list, repeat=1)
+    warm_seconds, _ = timeit(volatility_forecast.cal_universe_forecast, list(y), fitted, repeat=1)
+    print(f'{codes} codes ewma + garch: cold {cold_seconds:.3f}s, warm {warm_seconds:.3f}s')
+
+
+if __name__ == '__main__':
+    # python benchmark.py [bench_tree bjs ...]，可以省略bench_前缀，不带参数时按定义顺序全部运行
+    names = sys.argv[1:] or [i for i in globals() if i.startswith('bench_')]
+    for name in names:
+        globals()[name if name.startswith('bench_') else 'bench_' + name]()
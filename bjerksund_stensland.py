@@ -0,0 +1,189 @@
+"""
+Author: shifulin
+Email: shifulin666@qq.com
+
+Bjerksund-Stensland(2002)美式期权近似定价，闭式解不需要求根，参数可以是数组
+看跌期权用put-call变换: P(s, k, t, r, b) = C(k, s, t, r - b, -b)，b = r - q为持有成本
+"""
+from math import sqrt, pi, log, exp
+import numpy as np
+from numpy.polynomial.legendre import leggauss
+from norm_kernel import ndtr, ndtr_vec
+import european_option
+import jit_kernel
+
+
+# 两段时间的分割点t1 = (sqrt(5) - 1) / 2 * t，二元正态分布的相关系数是常数
+_T1_RATIO = (sqrt(5.0) - 1.0) / 2.0
+_RHO = sqrt(_T1_RATIO)
+_GAUSS_X, _GAUSS_W = leggauss(20)
+
+
+# 标量版本的积分表: psi中四个二元正态分布的相关系数依次为(rho, rho, -rho, -rho)
+_PSI_ASR = np.arcsin(np.array([_RHO, _RHO, -_RHO, -_RHO]))
+_PSI_SN = np.sin(_PSI_ASR[:, None] * (_GAUSS_X + 1.0) / 2.0)
+_PSI_INVERSE = 1.0 / (1.0 - _PSI_SN ** 2)
+
+
+def _bivariate_ndtr(a, b, rho):
+    # P(X < a, Y < b)，Drezner-Wesolowsky积分形式，|rho| < 0.925时20点Gauss-Legendre已达到双精度(Genz)
+    asr = np.arcsin(rho)
+    sn = np.sin(asr * (_GAUSS_X + 1.0) / 2.0)
+    a, b = np.asarray(a)[..., None], np.asarray(b)[..., None]
+    integral = np.sum(_GAUSS_W * np.exp((sn * a * b - (a ** 2 + b ** 2) / 2.0) / (1.0 - sn ** 2)), -1)
+    return ndtr_vec(a[..., 0]) * ndtr_vec(b[..., 0]) + asr / (4.0 * pi) * integral
+
+
+def _phi(s, t, gamma, h, i, r, b, sigma):
+    sigma_sqrt_t = sigma * np.sqrt(t)
+    lambda_ = (-r + gamma * b + 0.5 * gamma * (gamma - 1.0) * sigma ** 2) * t
+    d = -(np.log(s / h) + (b + (gamma - 0.5) * sigma ** 2) * t) / sigma_sqrt_t
+    kappa = 2.0 * b / sigma ** 2 + 2.0 * gamma - 1.0
+    return np.exp(lambda_) * s ** gamma * \
+        (ndtr_vec(d) - (i / s) ** kappa * ndtr_vec(d - 2.0 * np.log(i / s) / sigma_sqrt_t))
+
+
+def _psi(s, t, gamma, h, i2, i1, t1, r, b, sigma):
+    drift = b + (gamma - 0.5) * sigma ** 2
+    sigma_sqrt_t1, sigma_sqrt_t = sigma * np.sqrt(t1), sigma * np.sqrt(t)
+    e1 = (np.log(s / i1) + drift * t1) / sigma_sqrt_t1
+    e2 = (np.log(i2 ** 2 / (s * i1)) + drift * t1) / sigma_sqrt_t1
+    e3 = (np.log(s / i1) - drift * t1) / sigma_sqrt_t1
+    e4 = (np.log(i2 ** 2 / (s * i1)) - drift * t1) / sigma_sqrt_t1
+    f1 = (np.log(s / h) + drift * t) / sigma_sqrt_t
+    f2 = (np.log(i2 ** 2 / (s * h)) + drift * t) / sigma_sqrt_t
+    f3 = (np.log(i1 ** 2 / (s * h)) + drift * t) / sigma_sqrt_t
+    f4 = (np.log(s * i1 ** 2 / (h * i2 ** 2)) + drift * t) / sigma_sqrt_t
+    lambda_ = -r + gamma * b + 0.5 * gamma * (gamma - 1.0) * sigma ** 2
+    kappa = 2.0 * b / sigma ** 2 + 2.0 * gamma - 1.0
+    return np.exp(lambda_ * t) * s ** gamma * (
+        _bivariate_ndtr(-e1, -f1, _RHO) - (i2 / s) ** kappa * _bivariate_ndtr(-e2, -f2, _RHO) -
+        (i1 / s) ** kappa * _bivariate_ndtr(-e3, -f3, -_RHO) + (i1 / i2) ** kappa * _bivariate_ndtr(-e4, -f4, -_RHO))
+
+
+def _call(s, k, sigma, t, r, b):
+    """美式看涨，b >= r时不会提前行权，返回欧式价格，结果不低于内在价值"""
+    sigma_sqrt_t = sigma * np.sqrt(t)
+    d1 = (np.log(s / k) + (b + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+    european = s * np.exp((b - r) * t) * ndtr_vec(d1) - k * np.exp(-r * t) * ndtr_vec(d1 - sigma_sqrt_t)
+    early = b < r
+    if not np.any(early):
+        return european
+    t1 = _T1_RATIO * t
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        beta = (0.5 - b / sigma ** 2) + np.sqrt((b / sigma ** 2 - 0.5) ** 2 + 2.0 * r / sigma ** 2)
+        b_infinity = beta / (beta - 1.0) * k
+        b_0 = np.maximum(k, r / (r - b) * k)
+        h1 = -(b * t1 + 2.0 * sigma * np.sqrt(t1)) * k ** 2 / ((b_infinity - b_0) * b_0)
+        h2 = -(b * t + 2.0 * sigma_sqrt_t) * k ** 2 / ((b_infinity - b_0) * b_0)
+        i1 = b_0 + (b_infinity - b_0) * (1.0 - np.exp(h1))
+        i2 = b_0 + (b_infinity - b_0) * (1.0 - np.exp(h2))
+        alpha1 = (i1 - k) * i1 ** -beta
+        alpha2 = (i2 - k) * i2 ** -beta
+        args = (r, b, sigma)
+        price = alpha2 * s ** beta - alpha2 * _phi(s, t1, beta, i2, i2, *args) + \
+            _phi(s, t1, 1.0, i2, i2, *args) - _phi(s, t1, 1.0, i1, i2, *args) - \
+            k * _phi(s, t1, 0.0, i2, i2, *args) + k * _phi(s, t1, 0.0, i1, i2, *args) + \
+            alpha1 * _phi(s, t1, beta, i1, i2, *args) - alpha1 * _psi(s, t, beta, i1, i2, i1, t1, *args) + \
+            _psi(s, t, 1.0, i1, i2, i1, t1, *args) - _psi(s, t, 1.0, k, i2, i1, t1, *args) - \
+            k * _psi(s, t, 0.0, i1, i2, i1, t1, *args) + k * _psi(s, t, 0.0, k, i2, i1, t1, *args)
+    # 近似公式在行权边界附近可能略低于内在价值
+    return np.maximum(np.where(early, np.where(s < i2, price, s - k), european), s - k)
+
+
+def _phi_scalar(s, t, gamma, h, i, r, b, sigma):
+    sigma_sqrt_t = sigma * sqrt(t)
+    lambda_ = (-r + gamma * b + 0.5 * gamma * (gamma - 1.0) * sigma ** 2) * t
+    d = -(log(s / h) + (b + (gamma - 0.5) * sigma ** 2) * t) / sigma_sqrt_t
+    kappa = 2.0 * b / sigma ** 2 + 2.0 * gamma - 1.0
+    return exp(lambda_) * s ** gamma * (ndtr(d) - (i / s) ** kappa * ndtr(d - 2.0 * log(i / s) / sigma_sqrt_t))
+
+
+def _psi_args(s, t, gamma, h, i2, i1, t1, r, b, sigma):
+    # psi = scale * sum(coefficient * M(a, b, rho))，返回scale、系数和四组二元正态分布的参数，由调用方一次算完
+    drift = b + (gamma - 0.5) * sigma ** 2
+    sigma_sqrt_t1, sigma_sqrt_t = sigma * sqrt(t1), sigma * sqrt(t)
+    e1 = (log(s / i1) + drift * t1) / sigma_sqrt_t1
+    e2 = (log(i2 ** 2 / (s * i1)) + drift * t1) / sigma_sqrt_t1
+    e3 = (log(s / i1) - drift * t1) / sigma_sqrt_t1
+    e4 = (log(i2 ** 2 / (s * i1)) - drift * t1) / sigma_sqrt_t1
+    f1 = (log(s / h) + drift * t) / sigma_sqrt_t
+    f2 = (log(i2 ** 2 / (s * h)) + drift * t) / sigma_sqrt_t
+    f3 = (log(i1 ** 2 / (s * h)) + drift * t) / sigma_sqrt_t
+    f4 = (log(s * i1 ** 2 / (h * i2 ** 2)) + drift * t) / sigma_sqrt_t
+    lambda_ = -r + gamma * b + 0.5 * gamma * (gamma - 1.0) * sigma ** 2
+    kappa = 2.0 * b / sigma ** 2 + 2.0 * gamma - 1.0
+    return exp(lambda_ * t) * s ** gamma, (1.0, -(i2 / s) ** kappa, -(i1 / s) ** kappa, (i1 / i2) ** kappa), \
+        (-e1, -e2, -e3, -e4), (-f1, -f2, -f3, -f4)
+
+
+def _psi_sum(args):
+    """args为若干个_psi_args的结果，所有二元正态分布一次向量计算，返回各个psi"""
+    scale, coefficient, a, b = (np.array(i) for i in zip(*args))
+    integral = np.sum(_GAUSS_W * np.exp((_PSI_SN * (a * b)[..., None] - ((a ** 2 + b ** 2) / 2.0)[..., None]) *
+                                        _PSI_INVERSE), -1)
+    bivariate = ndtr_vec(a) * ndtr_vec(b) + _PSI_ASR / (4.0 * pi) * integral
+    return (scale * np.sum(coefficient * bivariate, -1)).tolist()
+
+
+def _call_scalar(s, k, sigma, t, r, b):
+    """_call的标量版本，用math计算，只有psi中的20个二元正态分布合成一次数组运算，避免大量0维数组的开销"""
+    sigma_sqrt_t = sigma * sqrt(t)
+    if b >= r:
+        d1 = (log(s / k) + (b + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+        return max(s * exp((b - r) * t) * ndtr(d1) - k * exp(-r * t) * ndtr(d1 - sigma_sqrt_t), s - k)
+    t1 = _T1_RATIO * t
+    beta = (0.5 - b / sigma ** 2) + sqrt((b / sigma ** 2 - 0.5) ** 2 + 2.0 * r / sigma ** 2)
+    b_infinity = beta / (beta - 1.0) * k
+    b_0 = max(k, r / (r - b) * k)
+    h1 = -(b * t1 + 2.0 * sigma * sqrt(t1)) * k ** 2 / ((b_infinity - b_0) * b_0)
+    h2 = -(b * t + 2.0 * sigma_sqrt_t) * k ** 2 / ((b_infinity - b_0) * b_0)
+    i1 = b_0 + (b_infinity - b_0) * (1.0 - exp(h1))
+    i2 = b_0 + (b_infinity - b_0) * (1.0 - exp(h2))
+    if s >= i2:
+        return s - k
+    alpha1 = (i1 - k) * i1 ** -beta
+    alpha2 = (i2 - k) * i2 ** -beta
+    args = (r, b, sigma)
+    psi = _psi_sum([_psi_args(s, t, gamma, h, i2, i1, t1, *args)
+                    for gamma, h in ((beta, i1), (1.0, i1), (1.0, k), (0.0, i1), (0.0, k))])
+    price = alpha2 * s ** beta - alpha2 * _phi_scalar(s, t1, beta, i2, i2, *args) + \
+        _phi_scalar(s, t1, 1.0, i2, i2, *args) - _phi_scalar(s, t1, 1.0, i1, i2, *args) - \
+        k * _phi_scalar(s, t1, 0.0, i2, i2, *args) + k * _phi_scalar(s, t1, 0.0, i1, i2, *args) + \
+        alpha1 * _phi_scalar(s, t1, beta, i1, i2, *args) - alpha1 * psi[0] + psi[1] - psi[2] - k * psi[3] + k * psi[4]
+    return max(price, s - k)
+
+
+def bjs_price_vec(s, k, sigma, t, r, option_type, q=0.0):
+    """参数可以是数组，option_type为'Call'或'Put'"""
+    s, k, sigma, t, r, q, option_type = np.broadcast_arrays(
+        *(np.asarray(i, dtype=float) for i in (s, k, sigma, t, r, q)), np.asarray(option_type))
+    is_call = option_type == 'Call'
+    b = r - q
+    return _call(np.where(is_call, s, k), np.where(is_call, k, s), sigma, t, np.where(is_call, r, q),
+                 np.where(is_call, b, -b))
+
+
+def bjs_call(s, k, sigma, t, r, q=0.0):
+    if jit_kernel.ENABLED:
+        return jit_kernel.bjs_call(s, k, sigma, t, r, r - q)
+    return _call_scalar(s, k, sigma, t, r, r - q)
+
+
+def bjs_put(s, k, sigma, t, r, q=0.0):
+    if jit_kernel.ENABLED:
+        return jit_kernel.bjs_call(k, s, sigma, t, q, q - r)
+    return _call_scalar(k, s, sigma, t, q, q - r)
+
+
+def iv_vec(c, s, k, t, option_type, r=0.03, q=0.0, sigma_min=0.0001, sigma_max=3.0, e=1e-8, max_iter=50):
+    """
+    批量计算隐含波动率，见european_option.newton_iv_vec，vega用欧式vega
+    价格落在立即行权区域、对波动率不敏感的合约结果没有意义
+    """
+    return european_option.newton_iv_vec(c, s, k, t, option_type, r, q, bjs_price_vec, sigma_min=sigma_min,
+                                         sigma_max=sigma_max, e=e, max_iter=max_iter)
+
+
+call_iv = european_option.scalar_iv(iv_vec, 'Call')
+put_iv = european_option.scalar_iv(iv_vec, 'Put')
@@ -2,9 +2,21 @@
 Author: shifulin
 Email: shifulin666@qq.com
 """
+import os
 from math import log, sqrt, exp
 import numpy as np
-from scipy.stats import norm
+from scipy.special import ndtri, erfcx
+from norm_kernel import ndtr, ndtr_vec, npdf_vec
+import jit_kernel
+
+
+_SQRT2 = sqrt(2.0)
+_SQRT3 = sqrt(3.0)
+_SQRT_2PI = sqrt(2.0 * np.pi)
+IV_GRID_PATH = os.path.join(os.path.expanduser('~'), '.option_tools', 'iv_grid.npz')
+_iv_grid = None
+GREEKS_DTYPE = np.dtype([(i, float) for i in ('delta', 'gamma', 'theta', 'vega', 'rho',
+                                                 'vanna', 'volga', 'charm', 'speed')])
 
 
 # def bs_call(s, k, sigma, r, t):
@@ -18,6 +30,7 @@ from scipy.stats import norm
 #     d2 = d1 - sigma * np.sqrt(t)
 #     return k * np.exp(-r * t) * norm.cdf(-d2) - s * norm.cdf(-d1)
 
+
 def greeks(s, k, sigma, r, t, option_type):
     sqrt_t = sqrt(t)
     d1 = (log(s / k) + (r + pow(sigma, 2) / 2.0) * t) / (sigma * sqrt_t)
@@ -26,13 +39,13 @@ def greeks(s, k, sigma, r, t, option_type):
     tmp2 = sqrt(2.0 * np.pi * t)
     tmp3 = r * k * exp(-r * t)
     gamma = tmp / (s * sigma * tmp2)
-    theta_call = -(s * sigma * tmp) / (2.0 * tmp2) - tmp3 * norm.cdf(d2)
+    theta_call = -(s * sigma * tmp) / (2.0 * tmp2) - tmp3 * ndtr(d2)
     vega = s * sqrt_t * tmp / sqrt(2.0 * np.pi)
     if option_type == 'Call':
-        delta = norm.cdf(d1)
+        delta = ndtr(d1)
         theta = theta_call
     else:
-        delta = norm.cdf(d1) - 1.0
+        delta = ndtr(d1) - 1.0
         theta = theta_call + tmp3
     return delta, gamma, theta, vega
 
@@ -79,17 +92,133 @@ def bs_call(s, k, sigma, r, t):
     tmp = sqrt(t)
     d1 = (log(s / k) + (r + pow(sigma, 2) / 2.0) * t) / (sigma * tmp)
     d2 = d1 - sigma * tmp
-    return s * norm.cdf(d1) - k * exp(-r * t) * norm.cdf(d2)
+    return s * ndtr(d1) - k * exp(-r * t) * ndtr(d2)
 
 
 def bs_put(s, k, sigma, r, t):
     tmp = sqrt(t)
     d1 = (log(s / k) + (r + pow(sigma, 2) / 2.0) * t) / (sigma * tmp)
     d2 = d1 - sigma * tmp
-    return k * exp(-r * t) * norm.cdf(-d2) - s * norm.cdf(-d1)
+    return k * exp(-r * t) * ndtr(-d2) - s * ndtr(-d1)
+
+
+def _d1_d2(s, k, sigma, r, t):
+    sqrt_t = np.sqrt(t)
+    sigma_sqrt_t = sigma * sqrt_t
+    d1 = (np.log(s / k) + (r + sigma * sigma / 2.0) * t) / sigma_sqrt_t
+    return d1, d1 - sigma_sqrt_t, sqrt_t
+
+
+def _is_call(option_type):
+    return np.asarray(option_type) == 'Call'
+
+
+def bs_price_vec(s, k, sigma, r, t, option_type):
+    """向量化BS定价，参数为可广播的数组，option_type为'Call'/'Put'数组"""
+    s, k, sigma, r, t = (np.asarray(i, dtype=float) for i in (s, k, sigma, r, t))
+    d1, d2, _ = _d1_d2(s, k, sigma, r, t)
+    discount_k = k * np.exp(-r * t)
+    call = s * ndtr_vec(d1) - discount_k * ndtr_vec(d2)
+    return np.where(_is_call(option_type), call, call - s + discount_k)
+
+
+def bs_call_vec(s, k, sigma, r, t):
+    return bs_price_vec(s, k, sigma, r, t, 'Call')
+
+
+def bs_put_vec(s, k, sigma, r, t):
+    return bs_price_vec(s, k, sigma, r, t, 'Put')
+
+
+def greeks_vec(s, k, sigma, r, t, option_type):
+    """向量化希腊字母，返回(delta, gamma, theta, vega, rho)，共用d1/d2"""
+    s, k, sigma, r, t = (np.asarray(i, dtype=float) for i in (s, k, sigma, r, t))
+    is_call = _is_call(option_type)
+    d1, d2, sqrt_t = _d1_d2(s, k, sigma, r, t)
+    pdf_d1 = npdf_vec(d1)
+    cdf_d1 = ndtr_vec(d1)
+    cdf_d2 = ndtr_vec(d2)
+    discount_k = k * np.exp(-r * t)
+    gamma = pdf_d1 / (s * sigma * sqrt_t)
+    vega = s * sqrt_t * pdf_d1
+    theta_call = -s * sigma * pdf_d1 / (2.0 * sqrt_t) - r * discount_k * cdf_d2
+    delta = np.where(is_call, cdf_d1, cdf_d1 - 1.0)
+    theta = np.where(is_call, theta_call, theta_call + r * discount_k)
+    rho = np.where(is_call, t * discount_k * cdf_d2, t * discount_k * (cdf_d2 - 1.0))
+    return delta, gamma, theta, vega, rho
+
 
+def _greeks_full(s, k, sigma, r, t, is_call, d1, d2, sqrt_t, pdf_d1, cdf_d1, cdf_d2, discount_k):
+    # 标量和向量版本共用的公式，call/put只在delta、theta、rho上有区别
+    sigma_sqrt_t = sigma * sqrt_t
+    gamma = pdf_d1 / (s * sigma_sqrt_t)
+    vega = s * sqrt_t * pdf_d1
+    theta_call = -s * sigma * pdf_d1 / (2.0 * sqrt_t) - r * discount_k * cdf_d2
+    put_shift = 1.0 - is_call
+    return (
+        cdf_d1 - put_shift,
+        gamma,
+        theta_call + put_shift * r * discount_k,
+        vega,
+        t * discount_k * (cdf_d2 - put_shift),
+        -pdf_d1 * d2 / sigma,
+        vega * d1 * d2 / sigma,
+        -pdf_d1 * (2.0 * r * t - d2 * sigma_sqrt_t) / (2.0 * t * sigma_sqrt_t),
+        -gamma / s * (d1 / sigma_sqrt_t + 1.0),
+    )
 
-def call_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=1.0, e=0.00001):
+
+def greeks_full(s, k, sigma, r, t, option_type):
+    """
+    一次计算全部一阶和二阶希腊字母，返回GREEKS_DTYPE结构的记录:
+    delta, gamma, theta, vega, rho, vanna(d delta / d sigma), volga(d vega / d sigma),
+    charm(delta随时间流逝的变化率), speed(d gamma / d s)，theta和charm均按年计
+    """
+    sqrt_t = sqrt(t)
+    d1 = (log(s / k) + (r + sigma * sigma / 2.0) * t) / (sigma * sqrt_t)
+    d2 = d1 - sigma * sqrt_t
+    result = _greeks_full(s, k, sigma, r, t, float(option_type == 'Call'), d1, d2, sqrt_t,
+                          exp(-d1 * d1 / 2.0) / _SQRT_2PI, ndtr(d1), ndtr(d2), k * exp(-r * t))
+    return np.array(result, dtype=GREEKS_DTYPE)[()]
+
+
+def greeks_full_vec(s, k, sigma, r, t, option_type):
+    """greeks_full的向量化版本，返回GREEKS_DTYPE结构数组，整条期权链只需一次调用"""
+    s, k, sigma, r, t = np.broadcast_arrays(*(np.asarray(i, dtype=float) for i in (s, k, sigma, r, t)))
+    is_call = _is_call(option_type).astype(float)
+    d1, d2, sqrt_t = _d1_d2(s, k, sigma, r, t)
+    result = _greeks_full(s, k, sigma, r, t, is_call, d1, d2, sqrt_t,
+                          npdf_vec(d1), ndtr_vec(d1), ndtr_vec(d2), k * np.exp(-r * t))
+    result = np.broadcast_arrays(*result)
+    greeks_array = np.empty(result[0].shape, dtype=GREEKS_DTYPE)
+    for name, value in zip(GREEKS_DTYPE.names, result):
+        greeks_array[name] = value
+    return greeks_array
+
+
+def _iv_by_method(c, s, k, t, r, sigma_min, sigma_max, e, method, is_call):
+    # call_iv/put_iv的非二分法分支: 与二分法一样先按区间端点截断，区间内的价格再交给iv_vec
+    if method not in ('halley', 'rational', 'grid'):
+        raise ValueError(f'unknown iv method {method!r}')
+    price_func = bs_call if is_call else bs_put
+    if c <= price_func(s, k, sigma_min, r, t):
+        return sigma_min
+    elif c >= price_func(s, k, sigma_max, r, t):
+        return sigma_max
+    kwargs = {'sigma_min': sigma_min, 'sigma_max': sigma_max, 'e': e} if method == 'halley' else {}
+    sigma = float(iv_vec(c, s, k, t, 'Call' if is_call else 'Put', r=r, method=method, **kwargs)[0])
+    return min(max(sigma, sigma_min), sigma_max)
+
+
+def call_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=1.0, e=0.00001, method='bisection'):
+    """
+    method为'bisection'、'halley'、'rational'或'grid'，任何方法下价格低于(高于)sigma_min(sigma_max)对应的价格时
+    都返回sigma_min(sigma_max)，不会返回nan；e在bisection下是价格误差，在halley下是波动率误差，rational和grid不使用e
+    """
+    if method != 'bisection':
+        return _iv_by_method(c, s, k, t, r, sigma_min, sigma_max, e, method, True)
+    if jit_kernel.ENABLED:
+        return jit_kernel.bsm_iv(c, s, k, t, r, 0.0, sigma_min, sigma_max, e, True)
     sigma_mid = (sigma_min + sigma_max) / 2.0
     call_min = bs_call(s, k, sigma_min, r, t)
     call_max = bs_call(s, k, sigma_max, r, t)
@@ -111,7 +240,12 @@ def call_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=1.0, e=0.00001):
     return sigma_mid
 
 
-def put_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=1.0, e=0.00001):
+def put_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=1.0, e=0.00001, method='bisection'):
+    """参数和返回值的含义与call_iv相同"""
+    if method != 'bisection':
+        return _iv_by_method(c, s, k, t, r, sigma_min, sigma_max, e, method, False)
+    if jit_kernel.ENABLED:
+        return jit_kernel.bsm_iv(c, s, k, t, r, 0.0, sigma_min, sigma_max, e, False)
     sigma_mid = (sigma_min + sigma_max) / 2.0
     put_min = bs_put(s, k, sigma_min, r, t)
     put_max = bs_put(s, k, sigma_max, r, t)
@@ -132,6 +266,303 @@ def put_iv(c, s, k, t, r=0.03, sigma_min=0.01, sigma_max=1.0, e=0.00001):
     return sigma_mid
 
 
+def _iv_initial_guess(c, s, k, r, t, is_call):
+    # Corrado-Miller近似，put先按平价转成call价格；失效时退回Manaster-Koehler拐点
+    discount_k = k * np.exp(-r * t)
+    call = np.where(is_call, c, c + s - discount_k)
+    half_diff = (s - discount_k) / 2.0
+    tmp = call - half_diff
+    radicand = np.maximum(tmp * tmp - half_diff * half_diff * 4.0 / np.pi, 0.0)
+    guess = np.sqrt(2.0 * np.pi / t) / (s + discount_k) * (tmp + np.sqrt(radicand))
+    fallback = np.sqrt(2.0 * np.abs(np.log(s / discount_k)) / t)
+    guess = np.where(np.isfinite(guess) & (guess > 0.0), guess, fallback)
+    return np.clip(guess, 0.01, 3.0)
+
+
+def iv_vec(c, s, k, t, option_type, r=0.03, sigma_min=0.0001, sigma_max=5.0, e=1e-10, max_iter=50,
+           method='halley'):
+    """
+    向量化隐含波动率，默认用带区间保护的Halley迭代，e为波动率精度
+    method='rational'时改用iv_rational的有理插值反解，method='grid'时改用iv_grid的查表插值
+    返回(iv, converged)，价格超出无套利区间的元素iv为nan且converged为False
+    """
+    if method in ('rational', 'grid'):
+        sigma = (iv_rational if method == 'rational' else iv_grid)(c, s, k, t, option_type, r=r)
+        return sigma, np.isfinite(sigma)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c, s, k, t, r = np.broadcast_arrays(*(np.asarray(i, dtype=float) for i in (c, s, k, t, r)))
+        is_call = np.broadcast_to(_is_call(option_type), c.shape)
+        discount_k = k * np.exp(-r * t)
+        lower = np.where(is_call, np.maximum(s - discount_k, 0.0), np.maximum(discount_k - s, 0.0))
+        upper = np.where(is_call, s, discount_k)
+        valid = (c > lower) & (c < upper) & (t > 0.0)
+        # 按平价统一成虚值期权求解，实值期权的时间价值太小会损失精度
+        otm_call = discount_k >= s
+        target = np.where(is_call == otm_call, c, np.where(otm_call, c + s - discount_k, c - s + discount_k))
+        sigma = np.where(valid, _iv_initial_guess(target, s, k, r, t, otm_call), np.nan)
+        lo = np.full(c.shape, sigma_min)
+        hi = np.full(c.shape, sigma_max)
+        converged = np.zeros(c.shape, dtype=bool)
+        active = valid.copy()
+        for _ in range(max_iter):
+            if not active.any():
+                break
+            d1, d2, sqrt_t = _d1_d2(s, k, sigma, r, t)
+            call = s * ndtr_vec(d1) - discount_k * ndtr_vec(d2)
+            diff = np.where(otm_call, call, call - s + discount_k) - target
+            vega = s * sqrt_t * npdf_vec(d1)
+            hi = np.where(active & (diff > 0.0), sigma, hi)
+            lo = np.where(active & (diff < 0.0), sigma, lo)
+            newton = diff / vega
+            # Halley修正: vomma / vega = d1 * d2 / sigma
+            step = newton / np.maximum(1.0 - 0.5 * newton * d1 * d2 / sigma, 0.5)
+            new_sigma = sigma - step
+            new_sigma = np.where((new_sigma > lo) & (new_sigma < hi), new_sigma, (lo + hi) / 2.0)
+            done = active & ((diff == 0.0) | (np.abs(new_sigma - sigma) <= e) | (hi - lo <= e))
+            sigma = np.where(active & (diff != 0.0), new_sigma, sigma)
+            converged |= done
+            active &= ~done
+    return sigma, converged
+
+
+def _normalized_call(x, s):
+    # x = ln(F/K) <= 0 的标准化虚值call价格 C / sqrt(F * K)，s为总波动sigma * sqrt(t)
+    # h + t < 0 时用erfcx的形式计算，避免两项极小值相减损失精度
+    h, t = x / s, s / 2.0
+    direct = np.exp(x / 2.0) * ndtr_vec(h + t) - np.exp(-x / 2.0) * ndtr_vec(h - t)
+    asymptotic = 0.5 * np.exp(-0.5 * (h * h + t * t)) * (erfcx(-(h + t) / _SQRT2) - erfcx(-(h - t) / _SQRT2))
+    return np.where(h + t < 0.0, asymptotic, direct)
+
+
+def _normalized_vega(x, s):
+    h, t = x / s, s / 2.0
+    return np.exp(-0.5 * (h * h + t * t)) / _SQRT_2PI
+
+
+def _rational_cubic(x, x_l, x_r, y_l, y_r, d_l, d_r, r):
+    h = x_r - x_l
+    u = (x - x_l) / h
+    v = 1.0 - u
+    return (y_r * u ** 3 + (r * y_r - h * d_r) * u * u * v + (r * y_l + h * d_l) * u * v * v + y_l * v ** 3) / \
+        (1.0 + (r - 3.0) * u * v)
+
+
+def _rational_cubic_r(x_l, x_r, y_l, y_r, d_l, d_r, d2, right):
+    # 控制参数r使一端的二阶导数等于d2，并保证插值单调
+    h = x_r - x_l
+    delta = (y_r - y_l) / h
+    r = (0.5 * h * d2 + (d_r - d_l)) / np.where(right, d_r - delta, delta - d_l)
+    return np.maximum(np.where(np.isfinite(r), r, 0.0), (d_l + d_r) / delta)
+
+
+def _rational_iv_guess(x, beta):
+    """
+    Let's Be Rational式的初值，x <= 0，beta为标准化虚值call价格
+    以拐点s_c及其切线与0、b_max的交点s_l、s_u分成四段，每段用有理三次插值
+    """
+    ax = -x
+    b_max = np.exp(x / 2.0)
+    s_c = np.sqrt(2.0 * ax)
+    b_c = _normalized_call(x, s_c)
+    v_c = _normalized_vega(x, s_c)
+    s_l = s_c - b_c / v_c
+    b_l = _normalized_call(x, s_l)
+    v_l = _normalized_vega(x, s_l)
+    s_u = s_c + (b_max - b_c) / v_c
+    b_u = _normalized_call(x, s_u)
+    v_u = _normalized_vega(x, s_u)
+    # 中间两段: 直接插值s(b)，拐点处s对b的二阶导数为0
+    r = _rational_cubic_r(b_l, b_c, s_l, s_c, 1.0 / v_l, 1.0 / v_c, 0.0, True)
+    guess_mid_lower = _rational_cubic(beta, b_l, b_c, s_l, s_c, 1.0 / v_l, 1.0 / v_c, r)
+    r = _rational_cubic_r(b_c, b_u, s_c, s_u, 1.0 / v_c, 1.0 / v_u, 0.0, False)
+    guess_mid_upper = _rational_cubic(beta, b_c, b_u, s_c, s_u, 1.0 / v_c, 1.0 / v_u, r)
+    # 下段: f_l(s) = C * N(z)^3, z = -|x| / (sqrt(3) * s)，s趋于0时与b渐近一致且可解析求逆
+    coef = 2.0 * np.pi * ax / (3.0 * _SQRT3)
+    z = -ax / (_SQRT3 * s_l)
+    z_s, z_ss = -z / s_l, 2.0 * z / (s_l * s_l)
+    cdf_z, pdf_z = ndtr_vec(z), npdf_vec(z)
+    f_l = coef * cdf_z ** 3
+    f_s = 3.0 * coef * cdf_z * cdf_z * pdf_z * z_s
+    f_ss = 3.0 * coef * cdf_z * pdf_z * (2.0 * pdf_z * z_s * z_s - cdf_z * z * z_s * z_s + cdf_z * z_ss)
+    b_ss = v_l * (x * x / s_l ** 3 - s_l / 4.0)
+    d_r = f_s / v_l
+    d2 = (f_ss - f_s * b_ss / v_l) / (v_l * v_l)
+    f = _rational_cubic(beta, 0.0, b_l, 0.0, f_l, 1.0, d_r, _rational_cubic_r(0.0, b_l, 0.0, f_l, 1.0, d_r, d2, True))
+    guess_lower = ax / (_SQRT3 * np.abs(ndtri(np.cbrt(np.maximum(f, 0.0) / coef))))
+    # 上段: f_u(s) = N(-s/2)，b趋于b_max时df/db = -1 / (2cosh(x/2))
+    f_u = ndtr_vec(-s_u / 2.0)
+    f_s = -0.5 * npdf_vec(s_u / 2.0)
+    f_ss = -0.25 * s_u * f_s
+    b_ss = v_u * (x * x / s_u ** 3 - s_u / 4.0)
+    d_l = f_s / v_u
+    d_r = -1.0 / (b_max + 1.0 / b_max)
+    d2 = (f_ss - f_s * b_ss / v_u) / (v_u * v_u)
+    r_u = _rational_cubic_r(b_u, b_max, f_u, 0.0, d_l, d_r, d2, False)
+    f = _rational_cubic(beta, b_u, b_max, f_u, 0.0, d_l, d_r, r_u)
+    guess_upper = -2.0 * ndtri(np.maximum(f, 0.0))
+    guess = np.where(beta < b_l, guess_lower, np.where(beta < b_c, guess_mid_lower,
+                                                       np.where(beta < b_u, guess_mid_upper, guess_upper)))
+    # 平值时初值公式退化，但上段公式在x=0处是精确解
+    return np.where(s_l > 0.0, guess, -2.0 * ndtri((1.0 - beta) / 2.0)), beta < b_c
+
+
+def _householder_step(x, s, beta, lower):
+    # 三阶Householder迭代，下段对ln(b)求根，上段对ln(b_max - b)求根，使目标函数接近线性
+    b = _normalized_call(x, s)
+    b_1 = _normalized_vega(x, s)
+    r_2 = x * x / s ** 3 - s / 4.0
+    b_2 = b_1 * r_2
+    b_3 = b_1 * (r_2 * r_2 - 3.0 * x * x / s ** 4 - 0.25)
+    u = b_1 / b
+    g_lower = (np.log(b / beta), u, b_2 / b - u * u, b_3 / b - 3.0 * u * b_2 / b + 2.0 * u ** 3)
+    b_max = np.exp(x / 2.0)
+    w = b_max - b
+    u = b_1 / w
+    g_upper = (np.log((b_max - beta) / w), u, b_2 / w + u * u, b_3 / w + 3.0 * u * b_2 / w + 2.0 * u ** 3)
+    g, g_1, g_2, g_3 = (np.where(lower, i, j) for i, j in zip(g_lower, g_upper))
+    nu = -g / g_1
+    h_2 = g_2 / g_1
+    h_3 = g_3 / g_1
+    return s + nu * (1.0 + 0.5 * h_2 * nu) / (1.0 + nu * (h_2 + h_3 * nu / 6.0))
+
+
+def _normalize(c, s, k, t, option_type, r):
+    # 转成标准化坐标，并按平价统一成x <= 0的虚值call，无效元素的beta为nan
+    c, s, k, t, r = np.broadcast_arrays(*(np.asarray(i, dtype=float) for i in (c, s, k, t, r)))
+    is_call = np.broadcast_to(_is_call(option_type), c.shape)
+    forward = s * np.exp(r * t)
+    x = np.log(forward / k)
+    beta = c * np.exp(r * t) / np.sqrt(forward * k)
+    intrinsic = np.maximum(np.where(is_call, 1.0, -1.0) * (np.exp(x / 2.0) - np.exp(-x / 2.0)), 0.0)
+    beta = beta - intrinsic
+    x = -np.abs(x)
+    valid = (beta > 0.0) & (beta < np.exp(x / 2.0)) & (t > 0.0)
+    return x, np.where(valid, beta, np.nan), t
+
+
+def _rational_total_sigma(x, beta, steps=2):
+    total_sigma, lower = _rational_iv_guess(x, beta)
+    for _ in range(steps):
+        total_sigma = _householder_step(x, total_sigma, beta, lower)
+    return total_sigma
+
+
+def iv_rational(c, s, k, t, option_type, r=0.03, steps=2):
+    """
+    向量化隐含波动率，在(对数价值度, 总方差)标准化坐标下用有理插值给出初值，
+    再做steps次三阶Householder迭代，2次即可达到机器精度
+    价格超出无套利区间的元素返回nan
+    """
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        x, beta, t = _normalize(c, s, k, t, option_type, r)
+        total_sigma = _rational_total_sigma(x, beta, steps)
+    return total_sigma / np.sqrt(t)
+
+
+def _build_iv_grid(x_min=-3.0, x_num=301, z_min=-36.0, z_max=6.0, z_num=841):
+    # 横轴为sqrt(-x)，使平值附近的网格更密；纵轴为z = N^-1(beta / b_max)，把跨越几百个数量级的虚值价格映射到均匀网格上
+    # 节点处的总波动率用有理插值加两次迭代精确反解
+    x = np.linspace(0.0, sqrt(-x_min), x_num)
+    z = np.linspace(z_min, z_max, z_num)
+    x_node, z_node = np.meshgrid(-x * x, z, indexing='ij')
+    beta = np.exp(x_node / 2.0) * ndtr_vec(z_node)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        log_s = np.log(_rational_total_sigma(x_node, np.where(beta < np.exp(x_node / 2.0), beta, np.nan)))
+    return x, z, log_s
+
+
+def _load_iv_grid():
+    # 第一次使用时生成，缓存到IV_GRID_PATH，之后直接读取
+    global _iv_grid
+    if _iv_grid is None:
+        if os.path.isfile(IV_GRID_PATH):
+            with np.load(IV_GRID_PATH) as data:
+                _iv_grid = data['x'], data['z'], data['log_s']
+        else:
+            _iv_grid = _build_iv_grid()
+            os.makedirs(os.path.dirname(IV_GRID_PATH), exist_ok=True)
+            np.savez(IV_GRID_PATH, x=_iv_grid[0], z=_iv_grid[1], log_s=_iv_grid[2])
+    return _iv_grid
+
+
+def _grid_lookup(grid_x, grid_z, log_s, x, z):
+    # 均匀网格，直接算下标做双线性插值，表格外返回nan
+    x_num, z_num = log_s.shape
+    position_x = (x - grid_x[0]) / (grid_x[1] - grid_x[0])
+    position_z = (z - grid_z[0]) / (grid_z[1] - grid_z[0])
+    inside = (position_x >= 0.0) & (position_x <= x_num - 1) & (position_z >= 0.0) & (position_z <= z_num - 1)
+    i = np.clip(np.where(inside, position_x, 0.0).astype(int), 0, x_num - 2)
+    j = np.clip(np.where(inside, position_z, 0.0).astype(int), 0, z_num - 2)
+    u, v = position_x - i, position_z - j
+    value = (1.0 - u) * ((1.0 - v) * log_s[i, j] + v * log_s[i, j + 1]) + \
+        u * ((1.0 - v) * log_s[i + 1, j] + v * log_s[i + 1, j + 1])
+    return np.where(inside, np.exp(value), np.nan)
+
+
+def iv_grid(c, s, k, t, option_type, r=0.03):
+    """
+    向量化隐含波动率，在预先计算好的(对数价值度, 标准化价格)二维总波动率表中插值得到初值，再做一步三阶Householder修正
+    表格外的元素退回iv_rational，价格超出无套利区间的元素返回nan
+    """
+    grid_x, grid_z, log_s = _load_iv_grid()
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        x, beta, t = _normalize(c, s, k, t, option_type, r)
+        total_sigma = _grid_lookup(grid_x, grid_z, log_s, np.sqrt(-x), ndtri(beta / np.exp(x / 2.0)))
+        total_sigma = _householder_step(x, total_sigma, beta, total_sigma < np.sqrt(-2.0 * x))
+        outside = np.isnan(total_sigma) & np.isfinite(beta)
+        if outside.any():
+            total_sigma[outside] = _rational_total_sigma(x[outside], beta[outside])
+    return total_sigma / np.sqrt(t)
+
+
+def vega_vec(s, k, sigma, t, r, option_type, q=0.0):
+    """带连续股息率q的欧式vega，参数顺序与美式定价函数相同，作为newton_iv_vec的默认vega"""
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(s / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt_t)
+    return s * np.exp(-q * t) * sqrt_t * npdf_vec(d1)
+
+
+def newton_iv_vec(c, s, k, t, option_type, r, q, price_func, vega_func=vega_vec, sigma_min=0.0001, sigma_max=3.0,
+                  e=1e-8, max_iter=50):
+    """
+    反解任意定价函数的批量隐含波动率，price_func和vega_func的参数都是(s, k, sigma, t, r, option_type, q)
+    以欧式隐含波动率为初值做Newton迭代并保持二分区间，Newton步越出区间时取中点，已收敛的合约不再重新定价
+    e为价格误差，价格超出[sigma_min, sigma_max]对应价格范围的合约返回区间端点
+    """
+    c, s, k, t, r, q, option_type = np.broadcast_arrays(
+        *(np.asarray(i, dtype=float) for i in (c, s, k, t, r, q)), np.asarray(option_type))
+    shape = c.shape
+    c, s, k, t, r, q, option_type = (i.reshape(-1) for i in (c, s, k, t, r, q, option_type))
+    sigma, _ = iv_vec(c, s, k, t, option_type, r=r, method='rational')
+    sigma = np.clip(np.where(np.isfinite(sigma), sigma, (sigma_min + sigma_max) / 2.0), sigma_min, sigma_max)
+    low, high = np.full(sigma.shape, sigma_min), np.full(sigma.shape, sigma_max)
+    # 端点的波动率很极端，定价函数里可能出现除零，结果只用来比较
+    with np.errstate(all='ignore'):
+        below = c <= price_func(s, k, low, t, r, option_type, q)
+        above = c >= price_func(s, k, high, t, r, option_type, q)
+    active = np.flatnonzero(~below & ~above)
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+        i = active
+        diff = price_func(s[i], k[i], sigma[i], t[i], r[i], option_type[i], q[i]) - c[i]
+        done = np.abs(diff) < e
+        low[i], high[i] = np.where(diff < 0.0, sigma[i], low[i]), np.where(diff > 0.0, sigma[i], high[i])
+        i, diff = i[~done], diff[~done]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_sigma = sigma[i] - diff / vega_func(s[i], k[i], sigma[i], t[i], r[i], option_type[i], q[i])
+        sigma[i] = np.where((new_sigma > low[i]) & (new_sigma < high[i]), new_sigma, (low[i] + high[i]) / 2.0)
+        active = i
+    return np.where(below, sigma_min, np.where(above, sigma_max, sigma)).reshape(shape)
+
+
+def scalar_iv(iv_func, option_type):
+    """由批量隐含波动率函数iv_func(c, s, k, t, option_type, r, q, ...)得到单个合约的call_iv/put_iv"""
+    def iv(c, s, k, t, r=0.03, q=0.0, **kwargs):
+        return float(iv_func(c, s, k, t, option_type, r, q, **kwargs))
+    return iv
+
+
 # def my_test():
 #     call_iv(0.138, 3.046, 3.1, 0.5, r=0.03, sigma_min=0.01, sigma_max=1.0, e=0.000001)
 #
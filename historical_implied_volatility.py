@@ -15,6 +15,7 @@ from sina_commodity_option_api import get_option_kline as get_future_option_day_
 from sina_etf_option_api import get_option_day_kline as get_etf_option_day_kline
 import european_option
 # import american_option
+import american_spectral
 import baw
 
 
@@ -84,17 +85,17 @@ def align_kline(option_kline, spot_kline):
 
 
 def cal_historical_iv(option_kline, spot_kline, strike_price, expiry_date, r, option_type, exercise_type):
+    x = [str(option[0]) for option in option_kline]
+    option_cp = [option[1] for option in option_kline]
+    spot_cp = [spot[1] for spot in spot_kline]
+    t = [days_interval(option[0], expiry_date)[1] for option in option_kline]
     if exercise_type == 'european':
-        iv_func = european_option.call_iv if option_type == 'Call' else european_option.put_iv
+        y, _ = european_option.iv_vec(option_cp, spot_cp, strike_price, t, option_type, r=r, method='rational')
+        y = y.tolist()
+    elif exercise_type == 'american_spectral':
+        y = american_spectral.iv_vec(option_cp, spot_cp, strike_price, t, option_type, r=r).tolist()
     else:
-        iv_func = baw.call_iv if option_type == 'Call' else baw.put_iv
-    x, y, option_cp, spot_cp = [], [], [], []
-    for option, spot in zip(option_kline, spot_kline):
-        x.append(str(option[0]))
-        t = days_interval(option[0], expiry_date)[1]
-        y.append(iv_func(option[1], spot[1], strike_price, t, r=r))
-        option_cp.append(option[1])
-        spot_cp.append(spot[1])
+        y = baw.iv_vec(option_cp, spot_cp, strike_price, t, option_type, r=r).tolist()
     return x, y, option_cp, spot_cp
 
 
@@ -131,7 +132,8 @@ def draw_picture(option_code, x, iv, option_cp, spot_cp, show=True):
 def main(option_code, spot_code, strike_price, expiry_date, option_type, exercise_type):
     option_kline, spot_kline = get_kline(option_code, spot_code)
     op_k, sp_k = align_kline(option_kline, spot_kline)
-    x, iv, option_cp, spot_cp = cal_historical_iv(op_k, sp_k, strike_price, expiry_date, 0.03, option_type, exercise_type)
+    x, iv, option_cp, spot_cp = cal_historical_iv(op_k, sp_k, strike_price, expiry_date, 0.03, option_type,
+                                                  exercise_type)
     draw_picture(option_code, x, iv, option_cp, spot_cp)
 
 
@@ -141,5 +143,6 @@ if __name__ == '__main__':
     # main('io2002C4050', '000300', 4050.0, '20200221', 'Call', 'european')
     # main('10002194', '510050', 3.1, '20200226', 'Call', 'european')
     # main('m2005C2800', 'm2005', 2800.0, '20200408', 'Call', 'american')
+    # main('m2005C2800', 'm2005', 2800.0, '20200408', 'Call', 'american_spectral')
     main('m2005P2600', 'm2005', 2600.0, '20200408', 'Put', 'american')
     # main('ta2005P4800', 'ta2005', 4800.0, '20200403', 'Put', 'american')
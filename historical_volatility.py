@@ -2,12 +2,18 @@
 Author: shifulin
 Email: shifulin666@qq.com
 """
+import os
 import math
+from math import log
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from requests import exceptions
 import numpy as np
 import matplotlib.pyplot as plt
 from sina_stock_kline_api import get_stock_day_kline, get_ex_data
 from sina_future_kline_api import get_future_day_kline
+from sina_commodity_option_api import PIN_ZHONG_PARAMS
+import volatility_forecast
 
 
 ETF_SPOT_MAP = {
@@ -17,39 +23,54 @@ ETF_SPOT_MAP = {
 }
 
 
+# 波动率锥分位数草图: 相对误差和覆盖的波动率(%)范围
+SKETCH_ACCURACY = 0.005
+SKETCH_RANGE = (0.01, 10000.0)
+_SKETCH_GAMMA = (1.0 + SKETCH_ACCURACY) / (1.0 - SKETCH_ACCURACY)
+_SKETCH_OFFSET = math.floor(log(SKETCH_RANGE[0]) / log(_SKETCH_GAMMA))
+_SKETCH_BINS = math.ceil(log(SKETCH_RANGE[1]) / log(_SKETCH_GAMMA)) - _SKETCH_OFFSET + 1
+
+
+def _kline_arrays(kline, date_key='date', close_key='close'):
+    """k线的日期(datetime64[D])和收盘价数组"""
+    dates = np.array([i[date_key][:10] for i in kline], dtype='datetime64[D]')
+    close = np.array([i[close_key] for i in kline], dtype=float)
+    return dates, close
+
+
+def _date_int(dates):
+    # datetime64[D]转成20200224这样的整数
+    year, month = dates.astype('datetime64[Y]'), dates.astype('datetime64[M]')
+    return (year.astype(int) + 1970) * 10000 + ((month - year).astype(int) + 1) * 100 + (dates - month).astype(int) + 1
+
+
 def cal_stock_fluctuation(code, kline, ex):
-    x, y = [], []
-    kline_data = kline[code]
-    for index, i in enumerate(kline_data):
-        if index > 0:
-            y.append(math.log(i['close'] / kline_data[index - 1]['close']))
-            x.append(int(''.join(i['date'][:10].split('-'))))
+    dates, close = _kline_arrays(kline[code])
+    x, y = _date_int(dates[1:]), np.log(close[1:] / close[:-1])
+    if len(x) == 0:
+        # 不足两根k线时没有收益率，也就没有需要替换的除权日
+        return x, y
     if code in ETF_SPOT_MAP:
-        listed_date = int(''.join(kline_data[0]['date'][:10].split('-')))
-        ex_date = [int(''.join(i['djr'][:10].split('-'))) for i in ex[code] if i['djr']]
-        ex_date = [i for i in ex_date if i > listed_date][::-1]
-        ex_result = {}
-        if ex_date:
-            spot_kline = kline[ETF_SPOT_MAP[code]]
-            last_date, last_close = 0, 0.0
-            for index, i in enumerate(spot_kline):
-                this_date = int(''.join(i['date'][:10].split('-')))
-                if index > 0:
-                    if last_date <= ex_date[0] < this_date:
-                        ex_result[this_date] = math.log(i['close'] / last_close)
-                        ex_date = ex_date[1:]
-                        if not ex_date:
-                            break
-                last_date = this_date
-                last_close = i['close']
-        # print(ex_result)
-        for index, i in enumerate(x):
-            if i in ex_result:
-                # print(i, y[index], ex_result[i])
-                y[index] = ex_result[i]
+        # 股权登记日之后的第一个交易日除权，当天的收益率用对应指数的收益率代替
+        ex_date = np.array([i['djr'][:10] for i in ex[code] if i['djr']], dtype='datetime64[D]')
+        ex_date = ex_date[ex_date > dates[0]]
+        spot_dates, spot_close = _kline_arrays(kline[ETF_SPOT_MAP[code]])
+        index = np.unique(np.searchsorted(spot_dates, ex_date, side='right'))
+        index = index[(index > 0) & (index < len(spot_dates))]
+        position = np.minimum(np.searchsorted(dates[1:], spot_dates[index]), len(x) - 1)
+        found = dates[1:][position] == spot_dates[index]
+        y[position[found]] = np.log(spot_close[index] / spot_close[index - 1])[found]
     return x, y
 
 
+def cal_ohlc(kline):
+    """开高低收数组，去掉第一根k线以和收益率对齐，股票和期货k线的字段名不同"""
+    if not kline:
+        return tuple(np.array([]) for _ in range(4))
+    keys = ('o', 'h', 'l', 'c') if 'c' in kline[0] else ('open', 'high', 'low', 'close')
+    return tuple(np.array([float(k[key]) for k in kline[1:]]) for key in keys)
+
+
 def get_stock_data(code):
     kline = {code: get_stock_day_kline(code)}
     if code in ETF_SPOT_MAP:
@@ -57,38 +78,188 @@ def get_stock_data(code):
         ex = {code: get_ex_data(code)}
     else:
         ex = {code: []}
-    return cal_stock_fluctuation(code, kline, ex)
+    x, y = cal_stock_fluctuation(code, kline, ex)
+    return x, y, cal_ohlc(kline[code])
 
 
 def cal_future_fluctuation(kline):
-    x, y = [], []
-    if kline:
-        last_close = float(kline[0]['c'])
-        for k in kline[1:]:
-            x.append(int(''.join(k['d'].split('-'))))
-            close = float(k['c'])
-            y.append(math.log(close / last_close))
-            last_close = close
-    return x, y
+    dates, close = _kline_arrays(kline, 'd', 'c')
+    return _date_int(dates[1:]), np.log(close[1:] / close[:-1])
 
 
 def get_future_data(code):
-    return cal_future_fluctuation(get_future_day_kline(code))
+    kline = get_future_day_kline(code)
+    x, y = cal_future_fluctuation(kline)
+    return x, y, cal_ohlc(kline)
+
+
+def get_data(code, security_type):
+    if security_type == 'stock':
+        return get_stock_data(code)
+    elif security_type == 'future':
+        return get_future_data(code)
+
+
+def universe_codes():
+    """
+    期权标的全集: ETF和对应指数(io的标的000300已包含在内)，商品期权标的用新浪的主力连续合约(如M0)
+    返回[(代码, 'stock'或'future'), ...]
+    """
+    stock = list(dict.fromkeys(list(ETF_SPOT_MAP) + list(ETF_SPOT_MAP.values())))
+    future = [i.upper() + '0' for i in PIN_ZHONG_PARAMS if i != 'io']
+    return [(i, 'stock') for i in stock] + [(i, 'future') for i in future]
+
+
+def _cumsum(v):
+    return np.concatenate((np.zeros(v.shape[:-1] + (1,)), np.cumsum(v, axis=-1)), axis=-1)
+
+
+def rolling_mean(v, w):
+    """沿最后一维的滑动窗口均值，用累计和做到O(n)"""
+    s = _cumsum(v)
+    return (s[..., w:] - s[..., :-w]) / w
+
+
+def rolling_std_windows(y, window_size):
+    """
+    沿最后一维计算多个窗口长度的滑动窗口标准差(与np.std相同，不做自由度修正)，O(n)，累计和所有窗口共用
+    先减去整体均值再用累计和，避免平方和相减时的精度损失
+    """
+    y = np.asarray(y, dtype=float)
+    y = y - y.mean(axis=-1, keepdims=True)
+    sum1, sum2 = _cumsum(y), _cumsum(y ** 2)
+    return [np.sqrt(np.maximum((sum2[..., w:] - sum2[..., :-w]) / w - ((sum1[..., w:] - sum1[..., :-w]) / w) ** 2, 0.0))
+            for w in window_size]
+
+
+def rolling_std(y, w):
+    return rolling_std_windows(y, (w,))[0]
+
+
+def range_variance(y, ohlc, w, method):
+    """
+    基于开高低收的滑动窗口日方差，y为收盘价对数收益率，ohlc为与y对齐的(开, 高, 低, 收)
+    method为'parkinson'、'garman_klass'、'rogers_satchell'或'yang_zhang'
+    """
+    o, h, l, c = (np.asarray(i, dtype=float) for i in ohlc)
+    hl, co = np.log(h / l), np.log(c / o)
+    if method == 'parkinson':
+        return rolling_mean(hl ** 2, w) / (4.0 * log(2.0))
+    elif method == 'garman_klass':
+        return rolling_mean(0.5 * hl ** 2 - (2.0 * log(2.0) - 1.0) * co ** 2, w)
+    rs = rolling_mean(np.log(h / c) * np.log(h / o) + np.log(l / c) * np.log(l / o), w)
+    if method == 'rogers_satchell':
+        return rs
+    # Yang-Zhang: 隔夜方差 + k * 日内开收方差 + (1 - k) * Rogers-Satchell，前两项做自由度修正
+    # 隔夜收益取收盘收益减去日内收益，ETF的除权调整随y一起带入
+    k = 0.34 / (1.34 + (w + 1.0) / (w - 1.0))
+    overnight = rolling_std(np.asarray(y, dtype=float) - co, w) ** 2
+    open_close = rolling_std(co, w) ** 2
+    return (overnight + k * open_close) * w / (w - 1.0) + (1.0 - k) * rs
 
 
-def cal_historical_volatility(y, window_size):
-    y2 = y[::-1]
+def cal_historical_volatility(y, window_size, ohlc=None, method='close'):
+    """method为'close'时用收盘价收益率的标准差，否则用range_variance的开高低收估计，需要传入ohlc"""
     hv_lines, hv_cone = [], []
     factor = np.sqrt(252) * 100.0
-    for w in window_size:
-        hv = [np.std(y2[i: i + w]) * factor for i in range(len(y2) - w + 1)]
+    if method == 'close':
+        std = rolling_std_windows(y, window_size)
+    else:
+        std = [np.sqrt(np.maximum(range_variance(y, ohlc, w, method), 0.0)) for w in window_size]
+    for v in std:
+        # 第一个元素是最近一个窗口
+        hv = v[::-1] * factor
         hv_lines.append(hv)
-        # hv_cone.append((max(hv), np.percentile(hv, 75), np.median(hv), np.percentile(hv, 25), min(hv), hv[0]))
+        if hv.size:
+            hv_cone.append((hv.max(), np.percentile(hv, 75), np.median(hv), np.percentile(hv, 25), hv.min(), hv[0]))
+        else:
+            hv_cone.append((np.nan,) * 6)
     return hv_lines, hv_cone
 
 
-def draw_picture(code, x, y, interval, window_size, show=True):
-    hv_lines, hv_cone = cal_historical_volatility(y, window_size)
+def _sketch_index(hv):
+    # 第i个桶覆盖(gamma^(i-1), gamma^i]，桶内取中点2 * gamma^i / (gamma + 1)
+    index = np.ceil(np.log(np.clip(hv, *SKETCH_RANGE)) / log(_SKETCH_GAMMA)).astype(int)
+    return index - _SKETCH_OFFSET
+
+
+class VolCone(object):
+    """
+    增量更新的波动率锥，每来一根k线的收益率只做O(窗口数)的更新
+    每个窗口用滑动Welford公式维护窗口内均值和平方和，当前波动率与rolling_std一致
+    历史波动率的分位数用对数分桶的直方图(DDSketch)流式估计，相对误差不超过SKETCH_ACCURACY，与数据顺序无关
+    (P²算法在波动率这种趋势性强、自相关的序列上偏差很大)，最大值和最小值精确记录
+    """
+    def __init__(self, window_size=(5, 15, 30, 50, 70, 90, 120, 150), probabilities=(0.25, 0.5, 0.75)):
+        self.window_size = np.array(window_size, dtype=int)
+        self.probabilities = np.array(probabilities, dtype=float)
+        k = len(self.window_size)
+        self.buffer = np.zeros(self.window_size.max())
+        self.n = 0
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.counts = np.zeros((k, _SKETCH_BINS), dtype=np.int64)
+        self.low = np.full(k, np.inf)
+        self.high = np.full(k, -np.inf)
+
+    def current(self):
+        """各窗口当前的年化波动率(%)，数据不足一个窗口时为nan"""
+        hv = np.sqrt(np.maximum(self.m2, 0.0) / self.window_size) * np.sqrt(252) * 100.0
+        return np.where(self.n >= self.window_size, hv, np.nan)
+
+    def update(self, y):
+        """加入一个对数收益率，返回各窗口当前波动率"""
+        w = self.window_size
+        full = self.n >= w
+        old = self.buffer[(self.n - w) % len(self.buffer)]
+        count = np.minimum(self.n + 1, w)
+        old_mean = self.mean
+        self.mean = np.where(full, old_mean + (y - old) / w, old_mean + (y - old_mean) / count)
+        self.m2 = self.m2 + np.where(full, (y - old) * (y - self.mean + old - old_mean),
+                                     (y - old_mean) * (y - self.mean))
+        self.buffer[self.n % len(self.buffer)] = y
+        self.n += 1
+        hv = self.current()
+        rows = np.flatnonzero(self.n >= w)
+        self.counts[rows, _sketch_index(hv[rows])] += 1
+        self.low[rows] = np.minimum(self.low[rows], hv[rows])
+        self.high[rows] = np.maximum(self.high[rows], hv[rows])
+        return hv
+
+    def extend(self, y):
+        for i in y:
+            self.update(i)
+        return self.current()
+
+    def cone(self):
+        """每个窗口一行: (最大值, 分位数从高到低, 最小值, 当前值)，默认分位数时与cal_historical_volatility的hv_cone对应"""
+        total = self.counts.sum(axis=1)
+        cumulative = np.cumsum(self.counts, axis=1)
+        quantiles = []
+        for p in self.probabilities[::-1]:
+            index = np.argmax(cumulative > (p * (total - 1))[:, None], axis=1)
+            value = 2.0 * _SKETCH_GAMMA ** (index + _SKETCH_OFFSET) / (_SKETCH_GAMMA + 1.0)
+            quantiles.append(np.clip(value, self.low, self.high))
+        result = np.column_stack([self.high] + quantiles + [self.low, self.current()])
+        result[total == 0, :-1] = np.nan
+        return result
+
+    def save(self, path):
+        np.savez_compressed(path, window_size=self.window_size, probabilities=self.probabilities, buffer=self.buffer,
+                            n=self.n, mean=self.mean, m2=self.m2, counts=self.counts, low=self.low, high=self.high)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            cone = cls(data['window_size'], data['probabilities'])
+            for key in ('buffer', 'mean', 'm2', 'counts', 'low', 'high'):
+                setattr(cone, key, data[key])
+            cone.n = int(data['n'])
+        return cone
+
+
+def draw_picture(code, x, y, interval, window_size, show=True, ohlc=None, method='close'):
+    hv_lines, hv_cone = cal_historical_volatility(y, window_size, ohlc, method)
     x_int = list(range(len(x)))
     len_window = len(window_size)
     fig, axs = plt.subplots(2, len_window, sharey=True, gridspec_kw={'hspace': 0, 'wspace': 0}, figsize=(13, 6.4))
@@ -124,10 +295,110 @@ def draw_picture(code, x, y, interval, window_size, show=True):
     else:
         buffer = BytesIO()
         plt.savefig(buffer, format='png')
+        plt.close(fig)
         return buffer.getvalue()
 
 
-def main(code, security_type='stock', window_size=(5, 15, 30, 50, 70, 90, 120, 150)):
+def cal_universe_volatility(y_list, window_size, ohlc_list=None, method='close'):
+    """
+    多个标的一起计算，收益率序列按最近一天右对齐拼成二维数组，所有标的的一个窗口只做一次向量运算
+    返回hv (标的数, 窗口数, 最长序列长度)，时间从旧到新，数据不足的位置为nan
+    以及hv_cone (标的数, 窗口数, 6)，每行与cal_historical_volatility的hv_cone相同
+    """
+    lengths = np.array([len(i) for i in y_list])
+    length = lengths.max()
+    y = np.zeros((len(y_list), length))
+    for i, v in enumerate(y_list):
+        y[i, length - len(v):] = v
+    if method != 'close':
+        # 补齐的k线开高低收都取1，对数收益为0
+        ohlc = np.ones((4, len(y_list), length))
+        for i, v in enumerate(ohlc_list):
+            ohlc[:, i, length - lengths[i]:] = v
+    factor = np.sqrt(252) * 100.0
+    hv = np.full((len(y_list), len(window_size), length), np.nan)
+    index = np.arange(length)
+    if method == 'close':
+        std = rolling_std_windows(y, window_size)
+    else:
+        std = [np.sqrt(np.maximum(range_variance(y, ohlc, w, method), 0.0)) for w in window_size]
+    for j, (w, v) in enumerate(zip(window_size, std)):
+        hv[:, j, w - 1:] = v * factor
+        hv[:, j][index < (length - lengths + w - 1)[:, None]] = np.nan
+    # 排序后nan都在末尾，按每行的有效个数线性插值得到分位数，与np.percentile相同
+    sorted_hv = np.sort(hv, axis=-1)
+    count = np.sum(~np.isnan(hv), axis=-1, keepdims=True)
+    last = np.maximum(count - 1, 0)
+    columns = []
+    for p in (1.0, 0.75, 0.5, 0.25, 0.0):
+        position = p * last
+        low = np.floor(position).astype(int)
+        high = np.minimum(low + 1, last)
+        value_low, value_high = (np.take_along_axis(sorted_hv, i, axis=-1) for i in (low, high))
+        columns.append(value_low + (position - low) * (value_high - value_low))
+    hv_cone = np.concatenate(columns + [hv[..., -1:]], axis=-1)
+    hv_cone[(count == 0)[..., 0], :-1] = np.nan
+    return hv, hv_cone
+
+
+def _fetch(item):
+    code, security_type = item
+    try:
+        return get_data(code, security_type)
+    except (exceptions.RequestException, ValueError) as e:
+        # 只跳过网络错误和无法解析的返回内容(json解析失败也是ValueError)，其它异常照常抛出
+        print(f'fetch {code} failed: {e}')
+        return None
+
+
+def _draw(item):
+    code, x, y, window_size, ohlc, method, path = item
+    plt.switch_backend('Agg')
+    with open(path, 'wb') as fp:
+        fp.write(draw_picture(code, x, y, math.ceil(len(x) / 20), window_size, show=False, ohlc=ohlc, method=method))
+    return path
+
+
+def batch(codes=None, window_size=(5, 15, 30, 50, 70, 90, 120, 150), method='close', path='hv.npz',
+          picture_dir=None, fetch_workers=8, draw_workers=4):
+    """
+    全部标的的历史波动率批量计算，codes为[(代码, 'stock'或'future'), ...]，默认universe_codes()
+    线程池并发下载k线，下载失败的标的跳过，全部失败时抛出RuntimeError
+    所有标的一次计算，结果写入npz: codes、window_size、dates (标的数, 长度)、hv、hv_cone
+    以及EWMA和GARCH(1,1)条件波动率ewma、garch (标的数, 长度)和garch_params (标的数, 3)
+    path已存在时用上一次的GARCH参数作为初值
+    picture_dir不为空时在进程池中画图，每个标的保存为picture_dir/代码.png
+    """
+    codes = universe_codes() if codes is None else codes
+    with ThreadPoolExecutor(max_workers=fetch_workers) as pool:
+        data = [(code, i) for (code, _), i in zip(codes, pool.map(_fetch, codes)) if i is not None and len(i[1]) > 1]
+    if not data:
+        raise RuntimeError(f'no kline data fetched for any of the {len(codes)} codes')
+    names = [i[0] for i in data]
+    x_list, y_list, ohlc_list = zip(*(i[1] for i in data))
+    hv, hv_cone = cal_universe_volatility(y_list, window_size, ohlc_list, method)
+    last_params = {}
+    if os.path.isfile(path):
+        with np.load(path) as last:
+            if 'garch_params' in last:
+                last_params = dict(zip(last['codes'], last['garch_params']))
+    ewma, garch, garch_params = volatility_forecast.cal_universe_forecast(y_list, [last_params.get(i) for i in names])
+    dates = np.zeros((len(names), hv.shape[-1]), dtype=np.int64)
+    for i, x in enumerate(x_list):
+        dates[i, dates.shape[1] - len(x):] = x
+    np.savez_compressed(path, codes=np.array(names), window_size=np.array(window_size), dates=dates,
+                        hv=hv.astype(np.float32), hv_cone=hv_cone, ewma=ewma.astype(np.float32),
+                        garch=garch.astype(np.float32), garch_params=garch_params)
+    if picture_dir is not None:
+        os.makedirs(picture_dir, exist_ok=True)
+        items = [(code, x, y, window_size, ohlc, method, os.path.join(picture_dir, f'{code}.png'))
+                 for code, x, y, ohlc in zip(names, x_list, y_list, ohlc_list)]
+        with ProcessPoolExecutor(max_workers=draw_workers) as pool:
+            list(pool.map(_draw, items))
+    return names, hv, hv_cone
+
+
+def main(code, security_type='stock', window_size=(5, 15, 30, 50, 70, 90, 120, 150), method='close'):
     # import pickle, os
     # if os.path.isfile('cache'):
     #     with open('cache', 'rb') as fp:
@@ -143,18 +414,17 @@ def main(code, security_type='stock', window_size=(5, 15, 30, 50, 70, 90, 120, 1
     #         pickle.dump(y, fp)
     #         pickle.dump(hv_lines, fp)
     #         pickle.dump(hv_cone, fp)
-    if security_type == 'stock':
-        x, y = get_stock_data(code)
-    elif security_type == 'future':
-        x, y = get_future_data(code)
-    else:
+    if security_type not in ('stock', 'future'):
         return
+    x, y, ohlc = get_data(code, security_type)
     interval = math.ceil(len(x) / 20)
-    draw_picture(code, x, y, interval, window_size, show=True)
+    draw_picture(code, x, y, interval, window_size, show=True, ohlc=ohlc, method=method)
 
 
 if __name__ == '__main__':
     # main('sz159919')
     # main('sh000300')
     main('m2005', security_type='future', window_size=(5, 15, 30, 50, 90, 120))
+    # main('m2005', security_type='future', window_size=(5, 10, 20, 30, 60), method='yang_zhang')
+    # batch(picture_dir='hv_png')
 
@@ -0,0 +1,255 @@
+"""
+Author: shifulin
+Email: shifulin666@qq.com
+
+可选的Numba加速内核，设置环境变量OPTION_TOOLS_JIT=1或者运行时设置jit_kernel.ENABLED = True启用，
+未安装numba时始终使用原来的纯Python实现
+numba只在第一次调用内核时导入和编译，不启用时导入本模块不会导入numba
+"""
+import os
+from importlib.util import find_spec
+from math import log, sqrt, exp, erfc, inf
+import numpy as np
+
+
+AVAILABLE = find_spec('numba') is not None
+ENABLED = AVAILABLE and os.environ.get('OPTION_TOOLS_JIT', '0') == '1'
+_SQRT1_2 = sqrt(0.5)
+_SQRT1_2PI = 1.0 / sqrt(2.0 * np.pi)
+_kernels = {}
+
+
+def _compile():
+    # 所有内核一起替换成numba版本，内核之间互相调用时numba在编译期按模块全局变量解析，必须都已经替换
+    try:
+        import numba
+    except ImportError:
+        numba = None
+    for name, func in _kernels.items():
+        globals()[name] = numba.njit(cache=True)(func) if numba is not None else func
+    _kernels.clear()
+
+
+def jit(func):
+    """登记一个内核，模块里的名字先绑定到一个占位函数，第一次调用时才编译全部内核"""
+    name = func.__name__
+    _kernels[name] = func
+
+    def lazy(*args):
+        if name in _kernels:
+            _compile()
+        return globals()[name](*args)
+
+    lazy.__name__, lazy.__doc__, lazy.py_func = name, func.__doc__, func
+    return lazy
+
+
+@jit
+def ndtr(x):
+    return 0.5 * erfc(-x * _SQRT1_2)
+
+
+@jit
+def bsm_price(s, k, sigma, t, r, q, is_call):
+    sqrt_t = sqrt(t)
+    d1 = (log(s / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt_t)
+    d2 = d1 - sigma * sqrt_t
+    if is_call:
+        return s * exp(-q * t) * ndtr(d1) - k * exp(-r * t) * ndtr(d2)
+    else:
+        return k * exp(-r * t) * ndtr(-d2) - s * exp(-q * t) * ndtr(-d1)
+
+
+@jit
+def bsm_iv(c, s, k, t, r, q, sigma_min, sigma_max, e, is_call):
+    sigma_mid = (sigma_min + sigma_max) / 2.0
+    price_min = bsm_price(s, k, sigma_min, t, r, q, is_call)
+    price_max = bsm_price(s, k, sigma_max, t, r, q, is_call)
+    price_mid = bsm_price(s, k, sigma_mid, t, r, q, is_call)
+    diff = c - price_mid
+    if c <= price_min:
+        return sigma_min
+    elif c >= price_max:
+        return sigma_max
+    while abs(diff) > e:
+        if c > price_mid:
+            sigma_min = sigma_mid
+        else:
+            sigma_max = sigma_mid
+        sigma_mid = (sigma_min + sigma_max) / 2.0
+        price_mid = bsm_price(s, k, sigma_mid, t, r, q, is_call)
+        diff = c - price_mid
+    return sigma_mid
+
+
+@jit
+def tree_price(s, k, sigma, r, t, steps, is_call):
+    r_ = exp(r * (t / steps))
+    r_reciprocal = 1.0 / r_
+    u = exp(sigma * sqrt(t / steps))
+    d = 1.0 / u
+    u_square = u ** 2
+    p_u = (r_ - d) / (u - d)
+    p_d = 1.0 - p_u
+    sign = 1.0 if is_call else -1.0
+    prices = np.zeros(steps + 1)
+    prices[0] = s * d ** steps
+    for i in range(1, steps + 1):
+        prices[i] = prices[i - 1] * u_square
+    values = np.zeros(steps + 1)
+    for i in range(steps + 1):
+        values[i] = max(0.0, sign * (prices[i] - k))
+    for j in range(steps, 0, -1):
+        for i in range(j):
+            values[i] = (p_u * values[i + 1] + p_d * values[i]) * r_reciprocal
+            prices[i] = d * prices[i + 1]
+            values[i] = max(values[i], sign * (prices[i] - k))
+    return values[0]
+
+
+@jit
+def american_price(s, k, sigma, r, t, steps, is_call):
+    return (tree_price(s, k, sigma, r, t, steps, is_call) + tree_price(s, k, sigma, r, t, steps + 1, is_call)) / 2.0
+
+
+@jit
+def american_iv(c, s, k, t, r, sigma_min, sigma_max, e, steps, is_call):
+    sigma_mid = (sigma_min + sigma_max) / 2.0
+    price_min = american_price(s, k, sigma_min, r, t, steps, is_call)
+    price_max = american_price(s, k, sigma_max, r, t, steps, is_call)
+    price_mid = american_price(s, k, sigma_mid, r, t, steps, is_call)
+    diff = c - price_mid
+    if c <= price_min:
+        return sigma_min
+    elif c >= price_max:
+        return sigma_max
+    while abs(diff) > e:
+        if c > price_mid:
+            sigma_min = sigma_mid
+        else:
+            sigma_max = sigma_mid
+        sigma_mid = (sigma_min + sigma_max) / 2.0
+        price_mid = american_price(s, k, sigma_mid, r, t, steps, is_call)
+        diff = c - price_mid
+    return sigma_mid
+
+
+@jit
+def baw_sx_residual(sx, k, sigma, t, r, q, is_call):
+    n = 2.0 * (r - q) / sigma ** 2
+    k_ = 2.0 * r / sigma ** 2 / (1.0 - exp(-r * t))
+    if sx < 0.0:
+        return inf
+    d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / (sigma * sqrt(t))
+    if is_call:
+        q2 = (1.0 - n + sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
+        return (bsm_price(sx, k, sigma, t, r, q, True) + (1.0 - exp(-q * t) * ndtr(d1)) * sx / q2 - sx + k) ** 2
+    else:
+        q1 = (1.0 - n - sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
+        return (bsm_price(sx, k, sigma, t, r, q, False) - (1.0 - exp(-q * t) * ndtr(-d1)) * sx / q1 + sx - k) ** 2
+
+
+@jit
+def baw_critical_price(k, sigma, t, r, q, e, max_iter, is_call, seed):
+    n = 2.0 * (r - q) / sigma ** 2
+    m = 2.0 * r / sigma ** 2
+    k_ = m / (1.0 - exp(-r * t))
+    sigma_sqrt_t = sigma * sqrt(t)
+    discount_q = exp(-q * t)
+    sign = 1.0 if is_call else -1.0
+    root = (1.0 - n + sign * sqrt((n - 1.0) ** 2 + 4.0 * k_)) / 2.0
+    root_inf = (1.0 - n + sign * sqrt((n - 1.0) ** 2 + 4.0 * m)) / 2.0
+    sx_inf = k / (1.0 - 1.0 / root_inf)
+    h = ((r - q) * t + sign * 2.0 * sigma_sqrt_t) * k / (k - sx_inf)
+    if seed > 0.0:
+        sx = seed
+    else:
+        exp_h = exp(h) if h < 0.0 else 0.0
+        sx = k + (sx_inf - k) * (1.0 - exp_h) if is_call else sx_inf + (k - sx_inf) * exp_h
+    for _ in range(max_iter):
+        d1 = (log(sx / k) + (r - q + sigma ** 2 / 2.0) * t) / sigma_sqrt_t
+        premium = 1.0 - discount_q * ndtr(sign * d1)
+        f = sign * (sx - k) - bsm_price(sx, k, sigma, t, r, q, is_call) - sign * premium * sx / root
+        f_prime = sign - sign * discount_q * ndtr(sign * d1) - sign * premium / root + \
+            discount_q * exp(-d1 ** 2 / 2.0) * _SQRT1_2PI / (sigma_sqrt_t * root)
+        step = f / f_prime
+        new_sx = sx - step
+        if new_sx <= 0.0:
+            sx /= 2.0
+        elif (new_sx > k) == is_call:
+            sx = new_sx
+        else:
+            sx = (sx + k) / 2.0
+        if abs(step) < e * k:
+            break
+    return sx
+
+
+_GAUSS_X, _GAUSS_W = np.polynomial.legendre.leggauss(20)
+_BJS_T1_RATIO = (sqrt(5.0) - 1.0) / 2.0
+_BJS_RHO = sqrt(_BJS_T1_RATIO)
+
+
+@jit
+def bivariate_ndtr(a, b, rho):
+    asr = np.arcsin(rho)
+    integral = 0.0
+    for i in range(len(_GAUSS_X)):
+        sn = np.sin(asr * (_GAUSS_X[i] + 1.0) / 2.0)
+        integral += _GAUSS_W[i] * exp((sn * a * b - (a ** 2 + b ** 2) / 2.0) / (1.0 - sn ** 2))
+    return ndtr(a) * ndtr(b) + asr / (4.0 * np.pi) * integral
+
+
+@jit
+def bjs_phi(s, t, gamma, h, i, r, b, sigma):
+    sigma_sqrt_t = sigma * sqrt(t)
+    lambda_ = (-r + gamma * b + 0.5 * gamma * (gamma - 1.0) * sigma ** 2) * t
+    d = -(log(s / h) + (b + (gamma - 0.5) * sigma ** 2) * t) / sigma_sqrt_t
+    kappa = 2.0 * b / sigma ** 2 + 2.0 * gamma - 1.0
+    return exp(lambda_) * s ** gamma * (ndtr(d) - (i / s) ** kappa * ndtr(d - 2.0 * log(i / s) / sigma_sqrt_t))
+
+
+@jit
+def bjs_psi(s, t, gamma, h, i2, i1, t1, r, b, sigma):
+    drift = b + (gamma - 0.5) * sigma ** 2
+    sigma_sqrt_t1, sigma_sqrt_t = sigma * sqrt(t1), sigma * sqrt(t)
+    e1 = (log(s / i1) + drift * t1) / sigma_sqrt_t1
+    e2 = (log(i2 ** 2 / (s * i1)) + drift * t1) / sigma_sqrt_t1
+    e3 = (log(s / i1) - drift * t1) / sigma_sqrt_t1
+    e4 = (log(i2 ** 2 / (s * i1)) - drift * t1) / sigma_sqrt_t1
+    f1 = (log(s / h) + drift * t) / sigma_sqrt_t
+    f2 = (log(i2 ** 2 / (s * h)) + drift * t) / sigma_sqrt_t
+    f3 = (log(i1 ** 2 / (s * h)) + drift * t) / sigma_sqrt_t
+    f4 = (log(s * i1 ** 2 / (h * i2 ** 2)) + drift * t) / sigma_sqrt_t
+    lambda_ = -r + gamma * b + 0.5 * gamma * (gamma - 1.0) * sigma ** 2
+    kappa = 2.0 * b / sigma ** 2 + 2.0 * gamma - 1.0
+    return exp(lambda_ * t) * s ** gamma * (
+        bivariate_ndtr(-e1, -f1, _BJS_RHO) - (i2 / s) ** kappa * bivariate_ndtr(-e2, -f2, _BJS_RHO) -
+        (i1 / s) ** kappa * bivariate_ndtr(-e3, -f3, -_BJS_RHO) +
+        (i1 / i2) ** kappa * bivariate_ndtr(-e4, -f4, -_BJS_RHO))
+
+
+@jit
+def bjs_call(s, k, sigma, t, r, b):
+    if b >= r:
+        return bsm_price(s, k, sigma, t, r, r - b, True)
+    t1 = _BJS_T1_RATIO * t
+    beta = (0.5 - b / sigma ** 2) + sqrt((b / sigma ** 2 - 0.5) ** 2 + 2.0 * r / sigma ** 2)
+    b_infinity = beta / (beta - 1.0) * k
+    b_0 = max(k, r / (r - b) * k)
+    h1 = -(b * t1 + 2.0 * sigma * sqrt(t1)) * k ** 2 / ((b_infinity - b_0) * b_0)
+    h2 = -(b * t + 2.0 * sigma * sqrt(t)) * k ** 2 / ((b_infinity - b_0) * b_0)
+    i1 = b_0 + (b_infinity - b_0) * (1.0 - exp(h1))
+    i2 = b_0 + (b_infinity - b_0) * (1.0 - exp(h2))
+    if s >= i2:
+        return s - k
+    alpha1 = (i1 - k) * i1 ** -beta
+    alpha2 = (i2 - k) * i2 ** -beta
+    price = alpha2 * s ** beta - alpha2 * bjs_phi(s, t1, beta, i2, i2, r, b, sigma) + \
+        bjs_phi(s, t1, 1.0, i2, i2, r, b, sigma) - bjs_phi(s, t1, 1.0, i1, i2, r, b, sigma) - \
+        k * bjs_phi(s, t1, 0.0, i2, i2, r, b, sigma) + k * bjs_phi(s, t1, 0.0, i1, i2, r, b, sigma) + \
+        alpha1 * bjs_phi(s, t1, beta, i1, i2, r, b, sigma) - \
+        alpha1 * bjs_psi(s, t, beta, i1, i2, i1, t1, r, b, sigma) + \
+        bjs_psi(s, t, 1.0, i1, i2, i1, t1, r, b, sigma) - bjs_psi(s, t, 1.0, k, i2, i1, t1, r, b, sigma) - \
+        k * bjs_psi(s, t, 0.0, i1, i2, i1, t1, r, b, sigma) + k * bjs_psi(s, t, 0.0, k, i2, i1, t1, r, b, sigma)
+    return max(price, s - k)
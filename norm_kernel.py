@@ -0,0 +1,32 @@
+"""
+Author: shifulin
+Email: shifulin666@qq.com
+"""
+from math import erfc, exp, sqrt, pi
+import numpy as np
+from scipy.special import ndtr as _ndtr
+
+
+_SQRT1_2 = sqrt(0.5)
+_INV_SQRT_2PI = 1.0 / sqrt(2.0 * pi)
+
+
+def ndtr(x):
+    """标准正态分布函数，标量版本，比scipy.stats.norm.cdf快约两个数量级"""
+    return 0.5 * erfc(-x * _SQRT1_2)
+
+
+def npdf(x):
+    """标准正态密度函数，标量版本"""
+    return exp(-0.5 * x * x) * _INV_SQRT_2PI
+
+
+def ndtr_vec(x):
+    """标准正态分布函数，数组版本"""
+    return _ndtr(x)
+
+
+def npdf_vec(x):
+    """标准正态密度函数，数组版本"""
+    x = np.asarray(x, dtype=float)
+    return np.exp(-0.5 * x * x) * _INV_SQRT_2PI
@@ -4,6 +4,7 @@ Email: shifulin666@qq.com
 """
 import math
 from io import BytesIO
+import numpy as np
 import matplotlib.pyplot as plt
 from sina_etf_option_api import get_option_time_line as get_etf_option_time_line
 from sina_stock_kline_api import get_stock_time_line, get_1minutes
@@ -48,8 +49,10 @@ def align_line(option_line, spot_line):
 
 
 def cal_iv(option_price, spot_price, k, t, option_type):
-    iv_func = european_option.call_iv if option_type == 'Call' else european_option.put_iv
-    return [iv_func(i, j, k, t) if (i > 0.00001 and j > 0.00001) else math.nan for i, j in zip(option_price, spot_price)]
+    option_price, spot_price = np.array(option_price, dtype=float), np.array(spot_price, dtype=float)
+    iv, _ = european_option.iv_vec(option_price, spot_price, k, t, option_type, method='rational')
+    iv[~((option_price > 0.00001) & (spot_price > 0.00001))] = math.nan
+    return iv.tolist()
 
 
 def draw_picture(times, option_price, spot_price, iv, option_code, show=True):
@@ -0,0 +1,114 @@
+"""
+Author: shifulin
+Email: shifulin666@qq.com
+
+条件波动率预测: EWMA(RiskMetrics)和GARCH(1,1)，结果与历史波动率一样是年化的百分数，可以和隐含波动率比较
+方差递推都是一阶线性滤波，用scipy.signal.lfilter计算，GARCH似然函数的梯度也由同样形式的递推解析得到
+"""
+import numpy as np
+from scipy.optimize import minimize
+from scipy.signal import lfilter
+
+
+RISK_METRICS_LAMBDA = 0.94
+# GARCH拟合时收益率放大成百分数，使omega的量级接近1
+SCALE = 100.0
+FACTOR = np.sqrt(252) * 100.0
+
+
+def ewma_variance(y, lambda_=RISK_METRICS_LAMBDA, seed_size=30):
+    """
+    沿最后一维计算EWMA方差，第t个元素用到第t天为止的收益率，是对下一天的预测，最后一个元素即明天的方差
+    零均值假设，初值取前seed_size个收益率平方的均值
+    """
+    y2 = np.asarray(y, dtype=float) ** 2
+    seed = np.mean(y2[..., :seed_size], axis=-1, keepdims=True)
+    return lfilter([1.0 - lambda_], [1.0, -lambda_], y2, axis=-1, zi=lambda_ * seed)[0]
+
+
+def ewma_volatility(y, lambda_=RISK_METRICS_LAMBDA, seed_size=30):
+    return np.sqrt(ewma_variance(y, lambda_, seed_size)) * FACTOR
+
+
+def _garch_filter(e2, omega, alpha, beta, h0):
+    # h[t] = omega + alpha * e2[t - 1] + beta * h[t - 1]，h[0] = h0，返回h[0..n]，最后一个元素是下一天的预测
+    h = lfilter([1.0], [1.0, -beta], omega + alpha * e2, zi=[beta * h0])[0]
+    return np.concatenate(([h0], h))
+
+
+def _garch_nll(params, e2, h0):
+    """平均每天的负对数似然(去掉常数项)及其对(omega, alpha, beta)的解析梯度，取平均使梯度的量级与样本长度无关"""
+    omega, alpha, beta = params
+    h = _garch_filter(e2[:-1], omega, alpha, beta, h0)
+    nll = 0.5 * np.mean(np.log(h) + e2 / h)
+    # dh[t] / dtheta = (1, e2[t - 1], h[t - 1]) + beta * dh[t - 1] / dtheta，dh[0] = 0
+    sources = np.stack((np.ones(len(e2) - 1), e2[:-1], h[:-1]))
+    dh = lfilter([1.0], [1.0, -beta], sources, axis=-1)
+    weight = 0.5 * (1.0 / h[1:] - e2[1:] / h[1:] ** 2) / len(e2)
+    return nll, dh @ weight
+
+
+def garch_fit(y, params=None):
+    """
+    GARCH(1,1)极大似然估计，返回(omega, alpha, beta)，omega对应原始收益率
+    params为上一次的估计结果时作为初值，每天只多一根k线，通常几步就收敛
+    """
+    e = (np.asarray(y, dtype=float) - np.mean(y)) * SCALE
+    e2 = e ** 2
+    h0 = np.mean(e2)
+    if params is None or not np.all(np.isfinite(params)):
+        x0 = np.array([h0 * 0.05, 0.05, 0.9])
+    else:
+        x0 = np.array([params[0] * SCALE ** 2, params[1], params[2]])
+    result = minimize(_garch_nll, x0, args=(e2, h0), jac=True, method='SLSQP',
+                      bounds=((1e-8, None), (0.0, 1.0), (0.0, 1.0)),
+                      constraints=({'type': 'ineq', 'fun': lambda x: 0.9999 - x[1] - x[2],
+                                    'jac': lambda x: np.array([0.0, -1.0, -1.0])},), options={'ftol': 1e-10})
+    omega, alpha, beta = result.x
+    return np.array([omega / SCALE ** 2, alpha, beta])
+
+
+def garch_variance(y, params):
+    """GARCH(1,1)的条件方差，与ewma_variance对齐: 第t个元素是用到第t天为止的收益率对下一天的预测"""
+    e = np.asarray(y, dtype=float) - np.mean(y)
+    e2 = e ** 2
+    return _garch_filter(e2, *params, np.mean(e2))[1:]
+
+
+def garch_volatility(y, params):
+    return np.sqrt(garch_variance(y, params)) * FACTOR
+
+
+def garch_term_volatility(y, params, days):
+    """未来days个交易日的平均年化波动率(%)，days可以是数组，可以和剩余期限相同的隐含波动率比较"""
+    omega, alpha, beta = params
+    persistence = alpha + beta
+    long_run = omega / (1.0 - persistence)
+    h_next = garch_variance(y, params)[-1]
+    days = np.asarray(days, dtype=float)
+    # sum_{k=0}^{days-1} persistence^k
+    total = np.where(persistence > 0.0, (1.0 - persistence ** days) / (1.0 - persistence), 1.0)
+    return np.sqrt(long_run + (h_next - long_run) * total / days) * FACTOR
+
+
+def cal_universe_forecast(y_list, params_list=None, lambda_=RISK_METRICS_LAMBDA):
+    """
+    全部标的的EWMA和GARCH条件波动率，按最近一天右对齐，返回ewma、garch (标的数, 最长序列长度)和GARCH参数 (标的数, 3)
+    EWMA所有标的一次滤波，左侧补齐的收益率取各自初值的平方根，使补齐部分方差保持不变
+    params_list为上一次的参数时作为各标的的初值
+    """
+    lengths = np.array([len(i) for i in y_list])
+    length = lengths.max()
+    seed = np.array([np.mean(np.square(i[:30])) for i in y_list])
+    y = np.repeat(np.sqrt(seed)[:, None], length, axis=1)
+    for i, v in enumerate(y_list):
+        y[i, length - len(v):] = v
+    padding = np.arange(length) < (length - lengths)[:, None]
+    ewma = lfilter([1.0 - lambda_], [1.0, -lambda_], y ** 2, axis=-1, zi=lambda_ * seed[:, None])[0]
+    ewma = np.where(padding, np.nan, np.sqrt(ewma) * FACTOR)
+    garch = np.full((len(y_list), length), np.nan)
+    params = np.full((len(y_list), 3), np.nan)
+    for i, v in enumerate(y_list):
+        params[i] = garch_fit(v, None if params_list is None else params_list[i])
+        garch[i, length - len(v):] = garch_volatility(v, params[i])
+    return ewma, garch, params
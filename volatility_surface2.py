@@ -51,23 +51,26 @@ class VolSurface(object):
 
     def update_price(self, spot_price, option_price):
         self.spot_price = spot_price
+        x, y, k, t, option_type, price = [], [], [], [], [], []
         for i in option_price:
-            price = (float(i[1]) + float(i[3])) / 2.0
-            x, y, k, t, option_type = self.code_to_info[i[-1]]
-            if option_type == 'Call':
-                index = 0
-                iv_func = european_option.call_iv
-            else:
-                index = 5
-                iv_func = european_option.put_iv
-            self.data[x, y, index] = price
-            iv = iv_func(price, spot_price, k, t)
-            delta, gamma, theta, vega = european_option.greeks(spot_price, k, iv, 0.03, t, option_type)
-            self.data[x, y, index] = delta
-            self.data[x, y, index + 1] = gamma
-            self.data[x, y, index + 2] = theta
-            self.data[x, y, index + 3] = vega
-            self.data[x, y, index + 4] = iv
+            info = self.code_to_info[i[-1]]
+            x.append(info.x)
+            y.append(info.y)
+            k.append(info.k)
+            t.append(info.t)
+            option_type.append(info.type)
+            price.append((float(i[1]) + float(i[3])) / 2.0)
+        if not price:
+            return
+        x, y = np.array(x), np.array(y)
+        iv, _ = european_option.iv_vec(price, spot_price, k, t, option_type, method='grid')
+        index = np.where(np.array(option_type) == 'Call', 0, 5)
+        delta, gamma, theta, vega, _ = european_option.greeks_vec(spot_price, k, iv, 0.03, t, option_type)
+        self.data[x, y, index] = delta
+        self.data[x, y, index + 1] = gamma
+        self.data[x, y, index + 2] = theta
+        self.data[x, y, index + 3] = vega
+        self.data[x, y, index + 4] = iv
 
     def init(self):
         strike_prices, expiry_dates = set(), set()